@@ -1,12 +1,19 @@
 import os
+import re
+import sys
 import json
 import time
+import asyncio
+import heapq
 import hashlib
 import argparse
+import functools
 import logging
 from datetime import datetime, timedelta
 from urllib.parse import urlparse, urlsplit, urlunsplit, parse_qsl, urlencode
-from openai import OpenAI
+import httpx
+import orjson
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -22,18 +29,56 @@ logging.basicConfig(
     handlers=[logging.FileHandler(log_filepath), logging.StreamHandler()]
 )
 
+# LLM response cache (keyed per day, so entries go stale after one run day)
+CACHE_DIR = "cache"
+os.makedirs(CACHE_DIR, exist_ok=True)
+
 def now_iso():
     return time.strftime("%Y-%m-%dT%H:%M:%S")
 
 def short_hash(s):
     return hashlib.sha1(s.encode()).hexdigest()[:10]
 
+def dumps(o, pretty=False):
+    return orjson.dumps(o, option=orjson.OPT_INDENT_2 if pretty else 0).decode()
+
+def any_term_re(terms):
+    # One compiled alternation scans the text once instead of N substring searches
+    return re.compile("|".join(map(re.escape, terms)))
+
+def cache_key(*parts):
+    run_id = time.strftime("%Y-%m-%d")
+    return hashlib.sha1("|".join(map(str, parts + (run_id,))).encode()).hexdigest()
+
+def cache_get(key):
+    try:
+        with open(os.path.join(CACHE_DIR, f"{key}.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def cache_put(key, value):
+    path = os.path.join(CACHE_DIR, f"{key}.json")
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(value, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+@functools.lru_cache(maxsize=8192)
 def hostname(u):
     try:
         return urlparse(u).netloc.lower()
     except:
         return ""
 
+@functools.lru_cache(maxsize=8192)
+def domain_suffixes(s):
+    # 'https://www.spectrum.ieee.org/x' -> ('www.spectrum.ieee.org', 'spectrum.ieee.org', 'ieee.org', 'org')
+    host = s.split("//", 1)[-1].split("/", 1)[0].split(":", 1)[0]
+    labels = host.split(".")
+    return tuple(".".join(labels[n:]) for n in range(len(labels)))
+
+@functools.lru_cache(maxsize=8192)
 def normalize_url(u):
     try:
         parts = urlsplit(u)
@@ -43,14 +88,33 @@ def normalize_url(u):
     except:
         return u
 
+@functools.lru_cache(maxsize=1)
 def client():
-    return OpenAI(base_url="https://openrouter.ai/api/v1", api_key=os.environ["OPENROUTER_API_KEY"])
-
-def call_chat(model, messages, temperature=0.2):
+    # Shared for the whole run so the connection pool and TLS sessions are reused
+    return AsyncOpenAI(
+        base_url="https://openrouter.ai/api/v1",
+        api_key=os.environ["OPENROUTER_API_KEY"],
+        http_client=httpx.AsyncClient(
+            timeout=60,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+        ),
+    )
+
+async def close_client():
+    if client.cache_info().currsize:
+        await client().close()
+        client.cache_clear()
+
+# Upper bound on in-flight LLM requests across all topics
+LLM_CONCURRENCY = 8
+llm_semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
+
+async def call_chat(model, messages, temperature=0.2):
     logging.info(f"LLM: {model}")
-    logging.debug(f"LLM INPUT:\n{json.dumps(messages, indent=2)}")
-    c = client()
-    resp = c.chat.completions.create(model=model, messages=messages, temperature=temperature)
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(f"LLM INPUT:\n{dumps(messages, pretty=True)}")
+    async with llm_semaphore:
+        resp = await client().chat.completions.create(model=model, messages=messages, temperature=temperature)
     content = resp.choices[0].message.content
     logging.debug(f"LLM OUTPUT:\n{content}")
     return content
@@ -61,30 +125,111 @@ def parse_json_or_empty(content):
     except:
         return {}
 
-def call_search(query, limit=10):
+# Cost control model for search
+SEARCH_MODEL = "openai/gpt-4o-mini-search-preview"
+# Queries sent per multi-search call
+SEARCH_BATCH_SIZE = 4
+
+async def call_search(query, limit=10):
+    model = SEARCH_MODEL
+    key = cache_key(model, query, limit)
+    cached = cache_get(key)
+    if cached is not None:
+        logging.info(f"Search (cached): '{query}' limit={limit}")
+        return cached
     logging.info(f"Search: '{query}' limit={limit}")
-    sys = "Return JSON only as {\"results\":[{\"title\",\"url\",\"snippet\",\"source\",\"published_at\"}...]}. No prose. If nothing recent, return {\"results\":[]}."
+    system = "Return JSON only as {\"results\":[{\"title\",\"url\",\"snippet\",\"source\",\"published_at\"}...]}. No prose. If nothing recent, return {\"results\":[]}."
     payload = {
         "task":"search",
         "query":query,
         "return":{"format":"json","fields":["title","url","snippet","source","published_at"]},
         "limit":limit
     }
-    # Cost control model for search
-    content = call_chat("openai/gpt-4o-mini-search-preview", [
-        {"role":"system","content":sys},
-        {"role":"user","content":json.dumps(payload)}
+    content = await call_chat(model, [
+        {"role":"system","content":system},
+        {"role":"user","content":dumps(payload)}
     ], temperature=0.0)
     data = parse_json_or_empty(content)
+    results = []
     if isinstance(data, dict) and isinstance(data.get("results"), list):
-        return data["results"]
-    if isinstance(data, list):
-        return data
-    return []
+        results = data["results"]
+    elif isinstance(data, list):
+        results = data
+    # Empty results may be a transient failure; only cache real hits
+    if results:
+        cache_put(key, results)
+    return results
+
+async def call_search_batch(queries, limit=10):
+    """
+    Run several searches in one LLM call, returning one result list per query (in order).
+    Cached queries are served from disk; queries the model leaves out of its reply
+    fall back to individual call_search calls.
+    """
+    found = {}
+    pending = []
+    for q in queries:
+        cached = cache_get(cache_key(SEARCH_MODEL, q, limit))
+        if cached is not None:
+            found[q] = cached
+        elif q not in pending:
+            pending.append(q)
+    if len(pending) == 1:
+        found[pending[0]] = await call_search(pending[0], limit=limit)
+    elif pending:
+        logging.info(f"Search batch: {pending} limit={limit}")
+        system = "Return JSON only as {\"batches\":[{\"query\":\"...\",\"results\":[{\"title\",\"url\",\"snippet\",\"source\",\"published_at\"}...]}...]} with one batch per query, in the given order. No prose. If nothing recent for a query, give it \"results\":[]."
+        payload = {
+            "task":"multi_search",
+            "queries":pending,
+            "return":{"format":"json","fields":["title","url","snippet","source","published_at"]},
+            "limit_per_query":limit
+        }
+        content = await call_chat(SEARCH_MODEL, [
+            {"role":"system","content":system},
+            {"role":"user","content":dumps(payload)}
+        ], temperature=0.0)
+        data = parse_json_or_empty(content)
+        batches = data.get("batches") if isinstance(data, dict) else None
+        if not isinstance(batches, list):
+            batches = []
+        for idx, b in enumerate(batches):
+            if not isinstance(b, dict) or not isinstance(b.get("results"), list):
+                continue
+            # Match on the echoed query, else on position
+            q = b.get("query")
+            if q not in pending:
+                q = pending[idx] if len(batches) == len(pending) else None
+            if q is None or q in found:
+                continue
+            found[q] = b["results"]
+            if b["results"]:
+                cache_put(cache_key(SEARCH_MODEL, q, limit), b["results"])
+        missing = [q for q in pending if q not in found]
+        if missing:
+            logging.info(f"Search batch incomplete, retrying {len(missing)} queries individually")
+            for q, res in zip(missing, await asyncio.gather(*[call_search(q, limit=limit) for q in missing])):
+                found[q] = res
+    return [found.get(q, []) for q in queries]
+
+async def search_all(queries, limit=10):
+    # Batch the queries and run the batches concurrently; results are flattened
+    chunks = [queries[n:n+SEARCH_BATCH_SIZE] for n in range(0, len(queries), SEARCH_BATCH_SIZE)]
+    out = []
+    for per_query in await asyncio.gather(*[call_search_batch(c, limit=limit) for c in chunks]):
+        for res in per_query:
+            out.extend(res or [])
+    return out
 
-def plan_queries(topic, window, depth):
+async def plan_queries(topic, window, depth):
+    model = "openrouter/horizon-alpha"
+    key = cache_key(model, topic, window, depth)
+    cached = cache_get(key)
+    if cached is not None:
+        logging.info(f"Plan (cached): topic='{topic}' depth={depth}")
+        return cached
     logging.info(f"Plan: topic='{topic}' depth={depth}")
-    sys = "Output strict JSON: {\"queries\":[],\"rationale\":\"\",\"expected_signals\":[\"\"]}. Keep queries focused and recent."
+    system = "Output strict JSON: {\"queries\":[],\"rationale\":\"\",\"expected_signals\":[\"\"]}. Keep queries focused and recent."
     prompt = {
         "goal":"Find the most important, novel, credible items on the topic.",
         "topic":topic,
@@ -93,19 +238,21 @@ def plan_queries(topic, window, depth):
         "constraints":{"max_results_this_step":8,"focus":"high-impact, credible sources, actionable insights","recent":"last 48-72 hours"},
         "output":["queries","rationale","expected_signals"]
     }
-    out = call_chat("openrouter/horizon-alpha", [
-        {"role":"system","content":sys},
-        {"role":"user","content":json.dumps(prompt)}
+    out = await call_chat(model, [
+        {"role":"system","content":system},
+        {"role":"user","content":dumps(prompt)}
     ], temperature=0.3)
     data = parse_json_or_empty(out) or {}
     qs = data.get("queries") if isinstance(data.get("queries"), list) else []
     if not qs:
         return {"queries":[f"{topic} {window}"],"rationale":"fallback","expected_signals":[]}
-    return {"queries":qs[:3],"rationale":data.get("rationale",""),"expected_signals":data.get("expected_signals",[])}
+    plan = {"queries":qs[:3],"rationale":data.get("rationale",""),"expected_signals":data.get("expected_signals",[])}
+    cache_put(key, plan)
+    return plan
 
-def decide_next(topic, depth, window, items_preview, plan_rationale):
+async def decide_next(topic, depth, window, items_preview, plan_rationale):
     logging.info(f"Decide: topic='{topic}' depth={depth}")
-    sys = "Output strict JSON: {\"action\":\"deepen|stop\",\"reason\":\"\",\"next_focus\":[\"...\"]}"
+    system = "Output strict JSON: {\"action\":\"deepen|stop\",\"reason\":\"\",\"next_focus\":[\"...\"]}"
     prompt = {
         "topic":topic,
         "depth":depth,
@@ -114,9 +261,9 @@ def decide_next(topic, depth, window, items_preview, plan_rationale):
         "plan_rationale":plan_rationale,
         "instruction":"If strong, novel, credible signals exist, stop. Otherwise deepen and propose 1-3 targeted queries."
     }
-    out = call_chat("openrouter/horizon-beta", [
-        {"role":"system","content":sys},
-        {"role":"user","content":json.dumps(prompt)}
+    out = await call_chat("openrouter/horizon-beta", [
+        {"role":"system","content":system},
+        {"role":"user","content":dumps(prompt)}
     ], temperature=0.2)
     data = parse_json_or_empty(out) or {}
     act = data.get("action","stop")
@@ -127,42 +274,56 @@ def decide_next(topic, depth, window, items_preview, plan_rationale):
         nf = []
     return {"action":act,"reason":data.get("reason",""),"next_focus":nf[:6]}
 
+@functools.lru_cache(maxsize=8192)
 def parse_dt(s):
     if not s:
         return None
     try:
-        return datetime.fromisoformat(str(s).replace("Z",""))
-    except:
+        # Strip only a trailing Z: results must stay naive to compare with utcnow(),
+        # and 3.11+ fromisoformat would otherwise return an aware datetime for it
+        return datetime.fromisoformat(s[:-1] if s.endswith("Z") else s)
+    except (TypeError, ValueError):
         return None
 
-def within_window(published_at, hours=48):
-    t = parse_dt(published_at)
+def as_dt(v):
+    # Items carry a pre-parsed '_pub_dt'; raw ISO strings are still accepted
+    return v if isinstance(v, datetime) else parse_dt(v)
+
+# Functions comparing against "now" take it as an argument so one pass uses a single clock read
+def within_window(published_at, hours=48, now=None):
+    t = as_dt(published_at)
     if not t:
         return False
-    return (datetime.utcnow() - t) <= timedelta(hours=hours)
-
-def topic_whitelist():
-    return {
-        "investing": ["ft.com","reuters.com","bloomberg.com","wsj.com","ec.europa.eu"],
-        "technical innovations": ["nature.com","science.org","arxiv.org","spectrum.ieee.org","ieee.org","openai.com","deepmind.google","mit.edu","mittechnologyreview.com","cell.com","aaas.org","sciencenews.org"],
-        "ai law": ["ec.europa.eu","whitehouse.gov","gov.uk","europa.eu","nist.gov","ft.com","reuters.com"],
-        "poland business": ["pulsbiznesu.pl","bankier.pl","forsal.pl","money.pl","pap.pl","rp.pl","wyborcza.biz","parkiet.com"],
-        "ai advancements": ["nature.com","science.org","arxiv.org","openai.com","deepmind.google","anthropic.com","ft.com","reuters.com","bloomberg.com","wsj.com","mittechnologyreview.com","ieee.org","spectrum.ieee.org","economist.com","nytimes.com"],
-        "ai news": ["reuters.com","bloomberg.com","ft.com","wsj.com","apnews.com","openai.com","deepmind.google","ai.meta.com","microsoft.com","abc.xyz","alphabet.com","investors.nvidia.com","ir.amazon.com"],
-        "big tech": ["reuters.com","bloomberg.com","ft.com","wsj.com","sec.gov","microsoft.com","alphabet.com","apple.com","ir.amazon.com","about.fb.com","investors.nvidia.com"],
-        "stock market - polish": ["pap.pl","pap.pl/biznes","parkiet.com","pulsbiznesu.pl","bankier.pl","forsal.pl","money.pl","rp.pl","wyborcza.biz","nbp.pl","gov.pl","ure.gov.pl","reuters.com","bloomberg.com"],
-        "best picks to buy stocks": ["reuters.com","bloomberg.com","ft.com","wsj.com","marketwatch.com","seekingalpha.com","morningstar.com","barrons.com"]
-    }
-
-def filter_items(items, topic, window_hours=48):
-    wl = topic_whitelist().get(topic.lower(), [])
+    return ((now or datetime.utcnow()) - t) <= timedelta(hours=hours)
+
+# Trusted domains per topic, used by the strict (depth >= 2) filter
+TOPIC_WHITELIST = {
+    "investing": ["ft.com","reuters.com","bloomberg.com","wsj.com","ec.europa.eu"],
+    "technical innovations": ["nature.com","science.org","arxiv.org","spectrum.ieee.org","ieee.org","openai.com","deepmind.google","mit.edu","mittechnologyreview.com","cell.com","aaas.org","sciencenews.org"],
+    "ai law": ["ec.europa.eu","whitehouse.gov","gov.uk","europa.eu","nist.gov","ft.com","reuters.com"],
+    "poland business": ["pulsbiznesu.pl","bankier.pl","forsal.pl","money.pl","pap.pl","rp.pl","wyborcza.biz","parkiet.com"],
+    "ai advancements": ["nature.com","science.org","arxiv.org","openai.com","deepmind.google","anthropic.com","ft.com","reuters.com","bloomberg.com","wsj.com","mittechnologyreview.com","ieee.org","spectrum.ieee.org","economist.com","nytimes.com"],
+    "ai news": ["reuters.com","bloomberg.com","ft.com","wsj.com","apnews.com","openai.com","deepmind.google","ai.meta.com","microsoft.com","abc.xyz","alphabet.com","investors.nvidia.com","ir.amazon.com"],
+    "big tech": ["reuters.com","bloomberg.com","ft.com","wsj.com","sec.gov","microsoft.com","alphabet.com","apple.com","ir.amazon.com","about.fb.com","investors.nvidia.com"],
+    "stock market - polish": ["pap.pl","pap.pl/biznes","parkiet.com","pulsbiznesu.pl","bankier.pl","forsal.pl","money.pl","rp.pl","wyborcza.biz","nbp.pl","gov.pl","ure.gov.pl","reuters.com","bloomberg.com"],
+    "best picks to buy stocks": ["reuters.com","bloomberg.com","ft.com","wsj.com","marketwatch.com","seekingalpha.com","morningstar.com","barrons.com"]
+}
+
+TOPIC_WHITELIST_SETS = {t: frozenset(domains) for t, domains in TOPIC_WHITELIST.items() if domains}
+TOPIC_WHITELIST_RE = {t: any_term_re(domains) for t, domains in TOPIC_WHITELIST.items() if domains}
+
+def filter_items(items, topic, window_hours=48, now=None):
+    now = now or datetime.utcnow()
+    wl = TOPIC_WHITELIST_SETS.get(topic.lower())
+    wl_re = TOPIC_WHITELIST_RE.get(topic.lower())
     kept, dropped_old, dropped_src = [], [], []
     for i in items:
         src = (i.get("source") or hostname(i["url"])).lower()
-        if wl and not any(d in src for d in wl):
+        # Exact domain hit first; substring scan only for sources that are not bare hosts
+        if wl and wl.isdisjoint(domain_suffixes(src)) and not wl_re.search(src):
             dropped_src.append(i)
             continue
-        if not within_window(i.get("published_at"), hours=window_hours):
+        if not within_window(i["_pub_dt"], hours=window_hours, now=now):
             dropped_old.append(i)
             continue
         kept.append(i)
@@ -188,10 +349,17 @@ MEDIUM_TIER = set([
     "businesswire.com","prnewswire.com","seekingalpha.com","morningstar.com","moneyweek.com","kiplinger.com"
 ])
 
+HIGH_TIER_RE = any_term_re(HIGH_TIER)
+MEDIUM_TIER_RE = any_term_re(MEDIUM_TIER)
+
 def source_tier(src):
     s = src.lower()
-    if any(d in s for d in HIGH_TIER): return "high"
-    if any(d in s for d in MEDIUM_TIER): return "medium"
+    suffixes = domain_suffixes(s)
+    if not HIGH_TIER.isdisjoint(suffixes): return "high"
+    if not MEDIUM_TIER.isdisjoint(suffixes): return "medium"
+    # Fall back to substring matching for sources that are not bare hostnames
+    if HIGH_TIER_RE.search(s): return "high"
+    if MEDIUM_TIER_RE.search(s): return "medium"
     if "github.com" in s or "github" in s or "repositorystats" in s:
         return "low"
     return "low"
@@ -208,29 +376,32 @@ BIG_NEWS_TERMS = [
     "launch","introducing","release","general availability","ga","price cut","pricing"
 ]
 
-def novelty_w(title, snippet):
-    txt = f"{title} {snippet}".lower()
+NOVELTY_RE = any_term_re(NOVELTY_TERMS)
+RESEARCH_RE = any_term_re(RESEARCH_TERMS)
+BIG_NEWS_RE = any_term_re(BIG_NEWS_TERMS)
+
+# Term weights take the item's lowercased "title snippet" text ('_lc_title_snippet')
+def novelty_w(txt):
     score = 0.0
-    if any(t in txt for t in NOVELTY_TERMS): score += 0.2
-    if any(t in txt for t in RESEARCH_TERMS): score += 0.15
+    if NOVELTY_RE.search(txt): score += 0.2
+    if RESEARCH_RE.search(txt): score += 0.15
     return score
 
-def big_news_w(title, snippet):
-    txt = f"{title} {snippet}".lower()
-    return 0.25 if any(t in txt for t in BIG_NEWS_TERMS) else 0.0
+def big_news_w(txt):
+    return 0.25 if BIG_NEWS_RE.search(txt) else 0.0
 
-def reason_tags(item):
+def reason_tags(item, now=None):
     tags = []
     # Triage age tag (7 days for triage)
-    if not within_window(item.get("published_at"), hours=7*24):
+    if not within_window(item["_pub_dt"], hours=7*24, now=now):
         tags.append("old")
     # Hype tag for low/medium with novelty
-    if item.get("source_quality") in ("low","medium") and novelty_w(item.get("title",""), item.get("snippet","")) > 0:
+    title_snip = item["_lc_title_snippet"]
+    if item.get("source_quality") in ("low","medium") and novelty_w(title_snip) > 0:
         tags.append("hype")
     if item.get("source_quality") == "high":
         tags.append("primary")
     # Uncertainty tag for weak sources or sensational claims
-    title_snip = f"{item.get('title','')} {item.get('snippet','')}".lower()
     if item.get("source_quality") == "low" or "arc-agi" in title_snip or "surpasses human" in title_snip:
         tags.append("uncertain")
     # Evergreen tag for stock-pick listicles (handled later but tag here)
@@ -238,7 +409,8 @@ def reason_tags(item):
         tags.append("evergreen")
     return tags
 
-def normalize_results(results, topic, depth, run_id):
+def normalize_results(results, topic, depth, run_id, now=None):
+    now = now or datetime.utcnow()
     out = []
     for r in results:
         url = (r.get("url") or "").strip()
@@ -248,6 +420,8 @@ def normalize_results(results, topic, depth, run_id):
         src = (r.get("source") or hostname(nurl)).lower()
         title = (r.get("title") or src).strip()
         pub = r.get("published_at","")
+        if pub is not None and not isinstance(pub, str):
+            pub = str(pub)  # keep parse_dt's cache key hashable
         snippet = (r.get("snippet") or "").strip()
         item_id = f"{run_id}-{short_hash(nurl)}"
         item = {
@@ -259,17 +433,23 @@ def normalize_results(results, topic, depth, run_id):
             "published_at": pub,
             "snippet": snippet,
             "topic": topic,
-            "depth": depth
+            "depth": depth,
+            # Frozen lowercase/parsed views for the filters and the score
+            "_lc_title": title.lower(),
+            "_lc_title_snippet": f"{title} {snippet}".lower(),
+            "_lc_url": nurl.lower(),
+            "_pub_dt": parse_dt(pub),
         }
-        item["tags"] = reason_tags(item)
+        item["tags"] = reason_tags(item, now=now)
         out.append(item)
     return out
 
 def dedupe_by_url(items):
+    # Item URLs are already normalized by normalize_results
     seen = set()
     out = []
     for i in items:
-        key = normalize_url(i["url"])
+        key = i["url"]
         if key in seen:
             continue
         seen.add(key)
@@ -279,99 +459,135 @@ def dedupe_by_url(items):
 # GitHub high-org release allowance
 HIGH_ORGS = ["microsoft","openai","google","deepmind","anthropic","nvidia","meta","facebook","apple","amazon","aws","huggingface","alphabet"]
 RELEASE_TERMS = ["release","v","tag","changelog","notes","launch","ga","general availability","releases/","release:"]
+HIGH_ORGS_SET = frozenset(HIGH_ORGS)
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+RELEASE_TERMS_RE = any_term_re(RELEASE_TERMS)
 
 def allow_github_repo(item):
-    s = (item.get("source") or "") + " " + (item.get("title") or "") + " " + (item.get("snippet") or "") + " " + item.get("url","")
-    s = s.lower()
+    s = f"{item['source']} {item['_lc_title_snippet']} {item['_lc_url']}"
     if "github" not in s:
         return True
-    org_hit = any(org in s for org in HIGH_ORGS)
-    rel_hit = any(term in s for term in RELEASE_TERMS)
-    return org_hit and rel_hit
+    # Orgs are whole tokens ('github.com/meta-llama'), so 'metadata' or 'laws' no longer count
+    org_hit = not HIGH_ORGS_SET.isdisjoint(TOKEN_RE.findall(s))
+    return org_hit and bool(RELEASE_TERMS_RE.search(s))
 
-def big_news_boost(i):
-    b = big_news_w(i.get("title",""), i.get("snippet",""))
+def big_news_boost(i, now=None):
+    b = big_news_w(i["_lc_title_snippet"])
     if b <= 0:
         return 0.0
     # Base boost from terms
     boost = b
     # Very fresh
-    if within_window(i.get("published_at"), hours=48):
+    if within_window(i["_pub_dt"], hours=48, now=now):
         boost += 0.12
     # High-tier
     if i.get("source_quality") == "high":
         boost += 0.08
     return boost
 
+NEWSLETTER_RE = any_term_re(["newsletter","axios.com/newsletters","substack.com"])
+
 def is_newsletter_like(item):
-    s = (item.get("source") or "") + " " + (item.get("url") or "") + " " + (item.get("title") or "")
-    s = s.lower()
-    return ("newsletter" in s) or ("axios.com/newsletters" in s) or ("substack.com" in s)
-
-def rank_basic(items):
-    domain_w = {
-        "reuters.com": 1.0, "bloomberg.com": 1.0, "ft.com": 0.9, "wsj.com": 0.9, "apnews.com": 0.7,
-        "nytimes.com": 0.8, "theatlantic.com": 0.6, "economist.com": 0.7,
-        "nature.com": 0.9, "science.org": 0.9, "cell.com": 0.7, "aaas.org": 0.5, "sciencenews.org": 0.5,
-        "ieee.org": 0.6, "spectrum.ieee.org": 0.6, "acm.org": 0.6,
-        "mittechnologyreview.com": 0.7, "mit.edu": 0.6,
-        "openai.com": 0.5, "deepmind.google": 0.5, "anthropic.com": 0.5, "ai.googleblog.com": 0.4, "ai.meta.com": 0.4, "microsoft.com": 0.5,
-        "investors.nvidia.com": 0.6, "ir.amazon.com": 0.6, "alphabet.com": 0.6, "abc.xyz": 0.6, "apple.com": 0.5, "about.fb.com": 0.5, "amd.com": 0.5, "intel.com": 0.5, "tsmc.com": 0.5,
-        "sec.gov": 0.7, "ec.europa.eu": 0.7, "europa.eu": 0.6, "whitehouse.gov": 0.7, "nist.gov": 0.6, "gov.uk": 0.6, "parliament.uk": 0.6, "oecd.org": 0.5,
-        "pap.pl": 0.6, "parkiet.com": 0.6, "pulsbiznesu.pl": 0.6, "bankier.pl": 0.5, "forsal.pl": 0.5, "money.pl": 0.5, "rp.pl": 0.5, "wyborcza.biz": 0.5, "nbp.pl": 0.6, "ure.gov.pl": 0.6
-    }
-    def recency_w(ts):
-        t = parse_dt(ts)
-        if not t:
-            return 0.0
-        age_h = (datetime.utcnow() - t).total_seconds()/3600
-        if age_h <= 48: return 0.8
-        if age_h <= 24*7: return 0.2
+    # No newsletter term contains a space, so checking the parts one by one matches the joined string
+    return any(NEWSLETTER_RE.search(s) for s in (item["source"], item["_lc_url"], item["_lc_title"]))
+
+# Source weights used by the ranking score
+DOMAIN_W = {
+    "reuters.com": 1.0, "bloomberg.com": 1.0, "ft.com": 0.9, "wsj.com": 0.9, "apnews.com": 0.7,
+    "nytimes.com": 0.8, "theatlantic.com": 0.6, "economist.com": 0.7,
+    "nature.com": 0.9, "science.org": 0.9, "cell.com": 0.7, "aaas.org": 0.5, "sciencenews.org": 0.5,
+    "ieee.org": 0.6, "spectrum.ieee.org": 0.6, "acm.org": 0.6,
+    "mittechnologyreview.com": 0.7, "mit.edu": 0.6,
+    "openai.com": 0.5, "deepmind.google": 0.5, "anthropic.com": 0.5, "ai.googleblog.com": 0.4, "ai.meta.com": 0.4, "microsoft.com": 0.5,
+    "investors.nvidia.com": 0.6, "ir.amazon.com": 0.6, "alphabet.com": 0.6, "abc.xyz": 0.6, "apple.com": 0.5, "about.fb.com": 0.5, "amd.com": 0.5, "intel.com": 0.5, "tsmc.com": 0.5,
+    "sec.gov": 0.7, "ec.europa.eu": 0.7, "europa.eu": 0.6, "whitehouse.gov": 0.7, "nist.gov": 0.6, "gov.uk": 0.6, "parliament.uk": 0.6, "oecd.org": 0.5,
+    "pap.pl": 0.6, "parkiet.com": 0.6, "pulsbiznesu.pl": 0.6, "bankier.pl": 0.5, "forsal.pl": 0.5, "money.pl": 0.5, "rp.pl": 0.5, "wyborcza.biz": 0.5, "nbp.pl": 0.6, "ure.gov.pl": 0.6
+}
+
+def domain_w(d):
+    # Weight of the longest listed domain suffix, e.g. 'www.spectrum.ieee.org' -> 'spectrum.ieee.org'
+    for suffix in domain_suffixes(d):
+        w = DOMAIN_W.get(suffix)
+        if w is not None:
+            return w
+    # Same substring fallback as source_tier for sources that are not bare hostnames
+    return max([w for k, w in DOMAIN_W.items() if k in d] or [0.0])
+
+def recency_w(ts, now=None):
+    t = as_dt(ts)
+    if not t:
         return 0.0
-
-    def score(i):
-        d = (i.get("source") or hostname(i["url"])).lower()
-        s = 1.0 + max([v for k,v in domain_w.items() if k in d] or [0.0])
-        s += recency_w(i.get("published_at"))
-
-        # Prefer confirmed high-tier items
-        if i.get("depth",1) >= 2 and i.get("source_quality") == "high":
-            s += 0.25
-
-        # Big news boost (slightly stronger)
-        s += big_news_boost(i) + 0.05  # extra nudge for strong signals
-
-        # novelty
-        nov = novelty_w(i.get("title",""), i.get("snippet",""))
-        if i.get("source_quality") == "low":
-            nov *= 0.4
-            s -= 0.15
-        s += nov
-
-        # Uncertain penalty stronger
-        if "uncertain" in (i.get("tags") or []):
-            s -= 0.25
-
-        # Newsletter penalty: larger if depth 1
-        if is_newsletter_like(i):
-            s -= 0.2 if i.get("depth",1) == 1 else 0.1
-
-        # De-emphasize generic GitHub trending
-        src_str = (i.get("source") or "") + " " + (i.get("title") or "")
-        if ("github" in src_str.lower()) and i.get("source_quality") == "low":
-            s -= 0.3
-            if not allow_github_repo(i):
-                s -= 0.5
-
-        # Evergreen penalty for listicles
-        if "evergreen" in (i.get("tags") or []):
-            s -= 0.35  # slightly stronger
-
-        return s
-
-    # Stable sort by score, with deterministic tie-break preferring confirmed
-    ranked = sorted(items, key=lambda x: (score(x), x.get("depth",1) >= 2, x.get("source_quality") == "high"), reverse=True)
-    return ranked
+    age_h = ((now or datetime.utcnow()) - t).total_seconds()/3600
+    if age_h <= 48: return 0.8
+    if age_h <= 24*7: return 0.2
+    return 0.0
+
+def score_item(i, now=None):
+    d = (i.get("source") or hostname(i["url"])).lower()
+    s = 1.0 + domain_w(d)
+    s += recency_w(i["_pub_dt"], now=now)
+
+    # Prefer confirmed high-tier items
+    if i.get("depth",1) >= 2 and i.get("source_quality") == "high":
+        s += 0.25
+
+    # Big news boost (slightly stronger)
+    s += big_news_boost(i, now=now) + 0.05  # extra nudge for strong signals
+
+    # novelty
+    nov = novelty_w(i["_lc_title_snippet"])
+    if i.get("source_quality") == "low":
+        nov *= 0.4
+        s -= 0.15
+    s += nov
+
+    # Uncertain penalty stronger
+    if "uncertain" in (i.get("tags") or []):
+        s -= 0.25
+
+    # Newsletter penalty: larger if depth 1
+    if is_newsletter_like(i):
+        s -= 0.2 if i.get("depth",1) == 1 else 0.1
+
+    # De-emphasize generic GitHub trending
+    if ("github" in i["source"] or "github" in i["_lc_title"]) and i.get("source_quality") == "low":
+        s -= 0.3
+        if not allow_github_repo(i):
+            s -= 0.5
+
+    # Evergreen penalty for listicles
+    if "evergreen" in (i.get("tags") or []):
+        s -= 0.35  # slightly stronger
+
+    return s
+
+def annotate_scores(items, now=None):
+    """
+    Compute each item's score once and keep it on the item as '_score'.
+    Must run after tagging (topic hygiene may still add 'evergreen'); rank_basic
+    calls it lazily, so items are scored the first time they are ranked.
+    """
+    now = now or datetime.utcnow()
+    for i in items:
+        if "_score" not in i:
+            i["_score"] = score_item(i, now=now)
+    return items
+
+def rank_key(i):
+    # Score, with deterministic tie-break preferring confirmed
+    return (i["_score"], i.get("depth",1) >= 2, i.get("source_quality") == "high")
+
+def rank_basic(items, limit=None, now=None):
+    annotate_scores(items, now=now)
+    # Only the top `limit` are needed: select them without sorting the rest
+    if limit is not None:
+        return heapq.nlargest(limit, items, key=rank_key)
+    # Stable sort by score
+    return sorted(items, key=rank_key, reverse=True)
+
+def public_item(i):
+    # Drop internal '_'-prefixed fields before items leave the pipeline
+    return {k: v for k, v in i.items() if not k.startswith("_")}
 
 def broad_queries(topic, window):
     return [
@@ -396,29 +612,30 @@ POLAND_CONFIRM_PACK = [
     "site:gov.pl/web/klimat OR site:ure.gov.pl last 48 hours"
 ]
 
-def topic_specific_hygiene(items, topic, drop_excess_evergreen=True, evergreen_cap=1):
+def topic_specific_hygiene(items, topic, drop_excess_evergreen=True, evergreen_cap=1, now=None):
     """
     Apply topic-specific hygiene at stage filtering time.
     - For 'best picks' style topics: tag evergreen listicles and require freshness or catalyst.
     - Optionally drop excess evergreen items beyond a small cap before ranking/merge.
     """
     tl = topic.lower()
+    # Identify best-picks style topics; nothing to do for any other topic
+    is_best_picks_topic = ("best picks" in tl) or ("stocks" in tl and ("best" in tl or "picks" in tl))
+    if not is_best_picks_topic:
+        return list(items)
+    now = now or datetime.utcnow()
     out = []
     evergreen_indices = []
     for idx, it in enumerate(items):
-        title_snip = f"{it.get('title','')} {it.get('snippet','')}".lower()
-        # Identify best-picks style topics
-        is_best_picks_topic = ("best picks" in tl) or ("stocks" in tl and ("best" in tl or "picks" in tl))
-        if is_best_picks_topic:
-            fresh72 = within_window(it.get("published_at"), hours=72)
-            catalyst = big_news_w(it.get("title",""), it.get("snippet","")) > 0
-            # Tag evergreen if not fresh and no catalyst
-            if not fresh72 and not catalyst:
-                if "evergreen" not in it["tags"]:
-                    it["tags"].append("evergreen")
-            # Collect index if evergreen to optionally prune
-            if "evergreen" in it["tags"]:
-                evergreen_indices.append(idx)
+        fresh72 = within_window(it["_pub_dt"], hours=72, now=now)
+        catalyst = big_news_w(it["_lc_title_snippet"]) > 0
+        # Tag evergreen if not fresh and no catalyst
+        if not fresh72 and not catalyst:
+            if "evergreen" not in it["tags"]:
+                it["tags"].append("evergreen")
+        # Collect index if evergreen to optionally prune
+        if "evergreen" in it["tags"]:
+            evergreen_indices.append(idx)
         out.append(it)
 
     # Optionally drop excess evergreen items before merge
@@ -445,129 +662,135 @@ def cap_newsletters(items, cap=1):
         out.append(it)
     return out
 
-def orchestrate(topics, window, max_depth, limit_total):
+async def run_topic(topic, window, max_depth, topic_limit, run_id):
+    """
+    Run the scout/deepen loop for one topic.
+    Returns (topic_items, log_entries) so topics can run concurrently and be merged in order.
+    """
+    log = []
+    depth = 1
+    topic_id = short_hash(topic + run_id)
+    topic_items = []
+    # Queries already searched for this topic; repeats would only return the same items
+    issued = set()
+
+    while depth <= max_depth:
+        # Depth 1: broad scout; Depth >=2: planned queries
+        if depth == 1:
+            queries = broad_queries(topic, window)
+            plan = {"queries": queries, "rationale": "broad-first", "expected_signals":[]}
+        else:
+            plan = await plan_queries(topic, window, depth)
+            queries = plan["queries"]
+
+        # Execute searches (batched, concurrently)
+        queries = [q for q in queries if q not in issued]
+        issued.update(queries)
+        step_raw = await search_all(queries, limit=8)
+        now = datetime.utcnow()
+        step_items = normalize_results(step_raw, topic, depth, run_id, now=now)
+        step_items = dedupe_by_url(step_items)
+
+        # Depth 1: relaxed freshness (<=7 days), no whitelist
+        if depth == 1:
+            relaxed, old1 = [], []
+            for it in step_items:
+                # Filter out extremely old
+                if within_window(it["_pub_dt"], hours=7*24, now=now):
+                    # Permit GitHub but will be de-emphasized later
+                    relaxed.append(it)
+                else:
+                    old1.append(it)
+            filtered, dropped_old, dropped_src = relaxed, old1, []
+            # Topic-specific hygiene
+            filtered = topic_specific_hygiene(filtered, topic, drop_excess_evergreen=True, evergreen_cap=1, now=now)
+            filtered = cap_newsletters(filtered)
+        else:
+            # Depth >=2: strict filter (whitelist + 48h)
+            filtered, dropped_old, dropped_src = filter_items(step_items, topic, window_hours=48, now=now)
+
+        preview = [{"title": i["title"], "source": i["source"], "url": i["url"]} for i in filtered[:6]]
+        decision = await decide_next(topic, depth, window, preview, plan["rationale"])
+        logging.info(f"Topic='{topic}' depth={depth} kept={len(filtered)} drop_old={len(dropped_old)} drop_src={len(dropped_src)} decision={decision['action']}")
+
+        log.append({
+            "topic": topic,
+            "topic_id": topic_id,
+            "depth": depth,
+            "plan": plan,
+            "decision": decision,
+            "found_raw": len(step_raw),
+            "kept": len(filtered),
+            "dropped_old": len(dropped_old),
+            "dropped_src": len(dropped_src),
+            "ts": now_iso()
+        })
+
+        # Merge filtered into topic_items, respecting per-topic cap
+        for it in filtered:
+            if len(topic_items) >= topic_limit:
+                break
+            topic_items.append(it)
+
+        # If asked to deepen and we still have slack for this topic, run confirm pass
+        if decision["action"] == "deepen" and depth < max_depth and len(topic_items) < topic_limit:
+            next_qs = decision.get("next_focus", []) or []
+            # Merge with default confirm pack
+            for q in DEFAULT_CONFIRM_PACK:
+                if q not in next_qs:
+                    next_qs.append(q)
+            # Add Poland confirm pack if topic is Polish market
+            if "polish" in topic.lower():
+                for q in POLAND_CONFIRM_PACK:
+                    if q not in next_qs:
+                        next_qs.append(q)
+
+            next_qs = [q for q in next_qs if q not in issued]
+            issued.update(next_qs)
+            raw2 = await search_all(next_qs, limit=8)
+            now = datetime.utcnow()
+            deeper = normalize_results(raw2, topic, depth+1, run_id, now=now)
+            deeper = dedupe_by_url(deeper)
+            deeper_f, d_old2, d_src2 = filter_items(deeper, topic, window_hours=48, now=now)
+            logging.info(f"Deeper topic='{topic}' depth={depth+1} kept={len(deeper_f)} drop_old={len(d_old2)} drop_src={len(d_src2)}")
+
+            # Prefer deeper items (confirmed): add and if exceed cap, keep best
+            topic_items = topic_items + deeper_f
+            if len(topic_items) > topic_limit:
+                topic_items = rank_basic(topic_items, limit=topic_limit, now=now)
+            depth += 1
+            # Continue planning if we still have room
+            if len(topic_items) < topic_limit:
+                continue
+            else:
+                break
+
+        # Stop if we reached per-topic cap or decision is stop
+        if len(topic_items) >= topic_limit or decision["action"] != "deepen":
+            break
+        # Otherwise continue inner while
+
+    logging.info(f"Completed topic='{topic}' with {len(topic_items)} items (cap {topic_limit}).")
+    return topic_items, log
+
+async def orchestrate(topics, window, max_depth, limit_total):
     logging.info(f"Orchestrate topics={topics} window='{window}' max_depth={max_depth} limit={limit_total}")
     run_id = time.strftime("%Y-%m-%d")
     log = []
     collected = []
     # Per-topic cap so one topic cannot exhaust budget
     topic_limit = max(3, limit_total // max(1, len(topics)))
-    global_budget = limit_total
-
-    for topic in topics:
-        depth = 1
-        topic_id = short_hash(topic + run_id)
-        topic_items = []
-
-        while depth <= max_depth:
-            # Depth 1: broad scout; Depth >=2: planned queries
-            if depth == 1:
-                queries = broad_queries(topic, window)
-                plan = {"queries": queries, "rationale": "broad-first", "expected_signals":[]}
-            else:
-                plan = plan_queries(topic, window, depth)
-                queries = plan["queries"]
-
-            # Execute searches
-            step_raw = []
-            for q in queries:
-                step_raw.extend(call_search(q, limit=8) or [])
-            step_items = normalize_results(step_raw, topic, depth, run_id)
-            step_items = dedupe_by_url(step_items)
-
-            # Depth 1: relaxed freshness (<=7 days), no whitelist
-            if depth == 1:
-                relaxed, old1 = [], []
-                for it in step_items:
-                    # Filter out extremely old
-                    if within_window(it.get("published_at"), hours=7*24):
-                        # Permit GitHub but will be de-emphasized later
-                        relaxed.append(it)
-                    else:
-                        old1.append(it)
-                filtered, dropped_old, dropped_src = relaxed, old1, []
-                # Topic-specific hygiene
-                filtered = topic_specific_hygiene(filtered, topic, drop_excess_evergreen=True, evergreen_cap=1)
-                filtered = cap_newsletters(filtered)
-            else:
-                # Depth >=2: strict filter (whitelist + 48h)
-                filtered, dropped_old, dropped_src = filter_items(step_items, topic, window_hours=48)
-
-            preview = [{"title": i["title"], "source": i["source"], "url": i["url"]} for i in filtered[:6]]
-            decision = decide_next(topic, depth, window, preview, plan["rationale"])
-            logging.info(f"Topic='{topic}' depth={depth} kept={len(filtered)} drop_old={len(dropped_old)} drop_src={len(dropped_src)} decision={decision['action']}")
-
-            log.append({
-                "topic": topic,
-                "topic_id": topic_id,
-                "depth": depth,
-                "plan": plan,
-                "decision": decision,
-                "found_raw": len(step_raw),
-                "kept": len(filtered),
-                "dropped_old": len(dropped_old),
-                "dropped_src": len(dropped_src),
-                "ts": now_iso()
-            })
-
-            # Merge filtered into topic_items, respecting per-topic cap
-            for it in filtered:
-                if len(topic_items) >= topic_limit:
-                    break
-                topic_items.append(it)
-
-            # If asked to deepen and we still have slack for this topic, run confirm pass
-            if decision["action"] == "deepen" and depth < max_depth and len(topic_items) < topic_limit:
-                next_qs = decision.get("next_focus", []) or []
-                # Merge with default confirm pack
-                for q in DEFAULT_CONFIRM_PACK:
-                    if q not in next_qs:
-                        next_qs.append(q)
-                # Add Poland confirm pack if topic is Polish market
-                if "polish" in topic.lower():
-                    for q in POLAND_CONFIRM_PACK:
-                        if q not in next_qs:
-                            next_qs.append(q)
-
-                raw2 = []
-                for q in next_qs:
-                    raw2.extend(call_search(q, limit=8) or [])
-                deeper = normalize_results(raw2, topic, depth+1, run_id)
-                deeper = dedupe_by_url(deeper)
-                deeper_f, d_old2, d_src2 = filter_items(deeper, topic, window_hours=48)
-                logging.info(f"Deeper topic='{topic}' depth={depth+1} kept={len(deeper_f)} drop_old={len(d_old2)} drop_src={len(d_src2)}")
-
-                # Prefer deeper items (confirmed): add and if exceed cap, keep best
-                for it in deeper_f:
-                    if len(topic_items) < topic_limit:
-                        topic_items.append(it)
-                    else:
-                        pool = rank_basic(topic_items + [it])
-                        topic_items = pool[:topic_limit]
-                depth += 1
-                # Continue planning if we still have room
-                if len(topic_items) < topic_limit:
-                    continue
-                else:
-                    break
-
-            # Stop if we reached per-topic cap or decision is stop
-            if len(topic_items) >= topic_limit or decision["action"] != "deepen":
-                break
-            # Otherwise continue inner while
 
-        # Merge per-topic items to global collected
+    # Topics are independent: run them concurrently (LLM calls are bounded by LLM_CONCURRENCY)
+    per_topic = await asyncio.gather(*[run_topic(t, window, max_depth, topic_limit, run_id) for t in topics])
+    # Merge per-topic items and logs to global collected, in topic order
+    for topic_items, topic_log in per_topic:
         collected.extend(topic_items)
-        logging.info(f"Completed topic='{topic}' with {len(topic_items)} items (cap {topic_limit}).")
-
-        # We keep processing all topics; do not stop early unless you prefer:
-        # if len(collected) >= global_budget:
-        #     logging.info("Global budget reached; stopping further topics.")
-        #     break
+        log.extend(topic_log)
 
     # Finalize
     collected = dedupe_by_url(collected)
-    ranked = rank_basic(collected)[:limit_total]
+    ranked = [public_item(i) for i in rank_basic(collected, limit=limit_total)]
     return {
         "run_id": run_id,
         "items": ranked,
@@ -581,6 +804,12 @@ def orchestrate(topics, window, max_depth, limit_total):
         }
     }
 
+async def run(topics, window, max_depth, limit_total):
+    try:
+        return await orchestrate(topics, window, max_depth, limit_total)
+    finally:
+        await close_client()
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--topics", type=str, required=True, help="Comma-separated list of topics")
@@ -591,18 +820,21 @@ def main():
 
     topics = [t.strip() for t in args.topics.split(",") if t.strip()]
 
-    res = orchestrate(topics, args.window, args.max_depth, args.limit)
+    res = asyncio.run(run(topics, args.window, args.max_depth, args.limit))
 
     output_dir = "output"
     os.makedirs(output_dir, exist_ok=True)
     timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
     output_filename = os.path.join(output_dir, f"{timestamp}_result.json")
 
-    with open(output_filename, "w", encoding="utf-8") as f:
-        json.dump(res, f, ensure_ascii=False, indent=2)
+    # Serialise once; the same UTF-8 buffer goes to the file and stdout
+    buf = orjson.dumps(res, option=orjson.OPT_INDENT_2)
+    with open(output_filename, "wb") as f:
+        f.write(buf)
 
     logging.info(f"Final output saved to {output_filename}")
-    print(json.dumps(res, ensure_ascii=False, indent=2))
+    sys.stdout.buffer.write(buf + b"\n")
+    sys.stdout.flush()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -3,54 +3,268 @@
 
 from __future__ import annotations
 
-import atexit
 import asyncio
+import hashlib
 import logging
+import re
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Optional
 
 import httpx
 from openai import AsyncOpenAI
 
+from semantic_cache import EmbeddingCache
+
 log = logging.getLogger(__name__)
 
+MODEL = "openrouter/horizon-beta"
+SYSTEM_PROMPT = "You are a helpful assistant for Telegram."
+REPLY_CACHE_SIZE = 1024
+# Upper bound on concurrent upstream completions across all chats
+MAX_CONCURRENT_CALLS = 8
+# Inputs answered locally without a model call
+DIRECT_REPLIES = {
+    "hi": "Hi! How can I help?",
+    "hello": "Hello! How can I help?",
+    "hey": "Hey! How can I help?",
+    "привет": "Привет! Чем помочь?",
+    "ping": "pong",
+}
+MAX_PROMPT_CHARS = 16000
+
+_WS_RE = re.compile(r"\s+")
+
+def normalize(text: str) -> str:
+    # Prefilter and semantic-lookup form: case-folded, whitespace collapsed. Not an exact-cache key, since
+    # case and indentation can matter (identifiers, code)
+    return _WS_RE.sub(" ", text.strip().lower())
+
+def _digest(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
 class PersonalAgent:
-    def __init__(self, openrouter_api_key: str) -> None:
+    def __init__(self, openrouter_api_key: str, semantic_cache_path: str | None = None) -> None:
         if not openrouter_api_key:
             raise RuntimeError("OPENROUTER_API_KEY is required")
 
-        self._http = httpx.AsyncClient(timeout=60.0)
+        # HTTP/2 lets concurrent chats multiplex over one TLS connection to OpenRouter
+        self._http = httpx.AsyncClient(
+            timeout=httpx.Timeout(60.0, connect=10.0),
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=50, max_connections=100, keepalive_expiry=120.0),
+        )
         self._client = AsyncOpenAI(
             api_key=openrouter_api_key,
             base_url="https://openrouter.ai/api/v1",
             http_client=self._http,
         )
-        atexit.register(self._close_httpx_on_exit)
+        # Exact-match replies; keyed on model + system prompt so changing either invalidates
+        self._reply_cache: OrderedDict[tuple[str, bytes, bytes], str] = OrderedDict()
+        self._system_key = _digest(SYSTEM_PROMPT)
+        self._sem = asyncio.Semaphore(MAX_CONCURRENT_CALLS)
+        # Singleflight: identical prompts arriving while one is in flight share its result
+        self._inflight: dict[tuple[str, bytes, bytes], asyncio.Future[Optional[str]]] = {}
+        self.direct_hits = 0
+        # Optional paraphrase-tolerant layer under the exact-match cache
+        self._semantic = EmbeddingCache(self._client, path=semantic_cache_path) if semantic_cache_path else None
+
+    async def __aenter__(self) -> PersonalAgent:
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def warmup(self) -> None:
+        # Open the TLS connection up front so the first user message doesn't pay for the handshake
+        try:
+            await self._client.models.list()
+        except Exception:
+            log.warning("OpenRouter warmup failed", exc_info=True)
+
+    async def aclose(self) -> None:
+        if self._semantic:
+            await self._semantic.save()
+            self._semantic.close()
+        await self._client.close()
+
+    async def clear_cache(self) -> int:
+        n = len(self._reply_cache)
+        self._reply_cache.clear()
+        if self._semantic:
+            n += await self._semantic.clear()
+        return n
+
+    def _remember(self, key: tuple[str, bytes, bytes], content: str) -> None:
+        self._reply_cache[key] = content
+        if len(self._reply_cache) > REPLY_CACHE_SIZE:
+            self._reply_cache.popitem(last=False)
+
+    async def _lookup(self, text: str, norm: str) -> tuple[tuple[str, bytes, bytes], Optional[str], Any]:
+        # Returns (exact key, cached reply or None, prompt embedding for a later semantic add)
+        key = (MODEL, self._system_key, _digest(text))
+        cached = self._reply_cache.get(key)
+        if cached is not None:
+            self._reply_cache.move_to_end(key)
+            return key, cached, None
+        vec = None
+        if self._semantic:
+            try:
+                vec = await self._semantic.embed(norm)
+                hit = await self._semantic.lookup(vec)
+                if hit is not None:
+                    self._remember(key, hit)
+                    return key, hit, None
+            except Exception:
+                log.warning("Semantic cache lookup failed", exc_info=True)
+        return key, None, vec
+
+    async def _store(self, key: tuple[str, bytes, bytes], vec: Any, content: str, finish_reason: Optional[str]) -> None:
+        # Only cache complete answers; truncated or filtered ones are worth retrying
+        if not content or finish_reason != "stop":
+            return
+        self._remember(key, content)
+        if vec is not None:
+            # The answer is already good; a cache write failure mustn't turn it into an error
+            try:
+                await self._semantic.add(vec, content)
+            except Exception:
+                log.exception("Semantic cache add failed")
+
+    def _messages(self, text: str) -> list[dict]:
+        # Static prefix first and marked cacheable so providers with prompt caching can reuse it
+        return [
+            {
+                "role": "system",
+                "content": [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}],
+            },
+            {"role": "user", "content": text},
+        ]
+
+    def _log_usage(self, usage: Any) -> None:
+        if not usage or not log.isEnabledFor(logging.DEBUG):
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None) if details else None
+        log.debug("usage prompt=%s cached=%s completion=%s", usage.prompt_tokens, cached, usage.completion_tokens)
+
+    def _direct(self, text: str, norm: str) -> Optional[str]:
+        if len(text) > MAX_PROMPT_CHARS:
+            answer = f"Message is too long ({len(text)} chars, limit {MAX_PROMPT_CHARS})."
+        else:
+            answer = DIRECT_REPLIES.get(norm.rstrip("!.?"))
+        if answer is not None:
+            self.direct_hits += 1
+            log.debug("Direct reply (%d so far)", self.direct_hits)
+        return answer
+
+    def _lead(self, key: tuple[str, bytes, bytes]) -> Optional[asyncio.Future[Optional[str]]]:
+        # Register as the in-flight call for key; None if another call already is
+        if key in self._inflight:
+            return None
+        fut: asyncio.Future[Optional[str]] = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        return fut
+
+    def _finish(self, key: tuple[str, bytes, bytes], fut: asyncio.Future[Optional[str]], content: Optional[str]) -> None:
+        # None tells followers the leader failed or was cancelled, so they make their own call
+        if self._inflight.get(key) is fut:
+            del self._inflight[key]
+        if not fut.done():
+            fut.set_result(content)
+
+    async def _follow(self, key: tuple[str, bytes, bytes]) -> Optional[str]:
+        pending = self._inflight.get(key)
+        return await asyncio.shield(pending) if pending is not None else None
 
     async def reply(self, text: str, chat_id: int | str | None, user_id: int | None) -> str:
+        norm = normalize(text)
+        direct = self._direct(text, norm)
+        if direct is not None:
+            return direct
+        key, cached, vec = await self._lookup(text, norm)
+        if cached is not None:
+            return cached
+        fut = None
+        while fut is None:
+            shared = await self._follow(key)
+            if shared is not None:
+                return shared
+            # No leader, or it failed: take over, unless another follower already has
+            fut = self._lead(key)
+        content: Optional[str] = None
         try:
-            resp = await self._client.chat.completions.create(
-                model="openrouter/horizon-beta",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant for Telegram."},
-                    {"role": "user", "content": text},
-                ],
-                temperature=0.7,
-            )
-            content = resp.choices[0].message.content or ""
-            return content.strip() if content else "(no content)"
+            content = await self._complete(key, vec, text)
         except Exception as e:
             log.exception("Model call failed")
             return f"Error calling model: {e}"
+        finally:
+            self._finish(key, fut, content)
+        return content
 
-    def _close_httpx_on_exit(self) -> None:
+    async def _complete(self, key: tuple[str, bytes, bytes], vec: Any, text: str) -> str:
+        async with self._sem:
+            resp = await self._client.chat.completions.create(
+                model=MODEL,
+                messages=self._messages(text),
+                temperature=0.7,
+            )
+        self._log_usage(resp.usage)
+        choice = resp.choices[0]
+        content = (choice.message.content or "").strip()
+        if not content:
+            return "(no content)"
+        await self._store(key, vec, content, choice.finish_reason)
+        return content
+
+    async def stream_reply(self, text: str, chat_id: int | str | None, user_id: int | None) -> AsyncIterator[str]:
+        """Yields text deltas as they arrive; a cache hit is yielded in one piece."""
+        norm = normalize(text)
+        direct = self._direct(text, norm)
+        if direct is not None:
+            yield direct
+            return
+        key, cached, vec = await self._lookup(text, norm)
+        if cached is not None:
+            yield cached
+            return
+        # An identical prompt already streaming for another chat: wait for its full text instead of a second call
+        fut = None
+        while fut is None:
+            shared = await self._follow(key)
+            if shared is not None:
+                yield shared
+                return
+            fut = self._lead(key)
+        content: Optional[str] = None
         try:
-            if hasattr(self._http, "aclose"):
-                try:
-                    loop = asyncio.get_event_loop()
-                except RuntimeError:
-                    loop = None
-                if loop and loop.is_running():
-                    loop.create_task(self._http.aclose())
-                else:
-                    asyncio.run(self._http.aclose())
-        except Exception:
-            pass
\ No newline at end of file
+            parts: list[str] = []
+            finish_reason = None
+            # The slot is held for the whole stream since the upstream request stays open until it ends
+            async with self._sem:
+                stream = await self._client.chat.completions.create(
+                    model=MODEL,
+                    messages=self._messages(text),
+                    temperature=0.7,
+                    stream=True,
+                )
+                n = 0
+                async for chunk in stream:
+                    # Chunks already buffered by httpx are parsed without suspending; checkpoint so other chats get a turn
+                    n += 1
+                    if (n & 0x1f) == 0:
+                        await asyncio.sleep(0)
+                    if not chunk.choices:
+                        continue
+                    choice = chunk.choices[0]
+                    delta = choice.delta.content if choice.delta else None
+                    if delta:
+                        parts.append(delta)
+                        yield delta
+                    if choice.finish_reason:
+                        finish_reason = choice.finish_reason
+            content = "".join(parts).strip()
+            await self._store(key, vec, content, finish_reason)
+        finally:
+            # Followers get the full text; an empty, failed or abandoned stream sends them off to make their own call
+            self._finish(key, fut, content or None)
+
@@ -22,17 +22,37 @@ def main() -> None:
     telegram_token = os.getenv("TELEGRAM_BOT_TOKEN")
     openrouter_key = os.getenv("OPENROUTER_API_KEY")
     storage_dir = os.getenv("BOT_STORAGE_DIR", "./storage")
+    semantic_cache_path = os.getenv("SEMANTIC_CACHE_PATH")  # e.g. ./storage/semantic_cache; unset disables
+    webhook_url = os.getenv("WEBHOOK_URL")  # public https base URL; unset = long polling
+    # Comma-separated Telegram user ids allowed to run admin commands (/cache_clear); unset = nobody
+    admin_user_ids = {int(x) for x in os.getenv("ADMIN_USER_IDS", "").replace(" ", "").split(",") if x}
 
     if not telegram_token:
         raise RuntimeError("Missing TELEGRAM_BOT_TOKEN in .env")
     if not openrouter_key:
         raise RuntimeError("Missing OPENROUTER_API_KEY in .env")
 
-    agent = PersonalAgent(openrouter_key)
-    comm = TelegramCommunicator(telegram_token, reply_fn=agent.reply, storage_dir=storage_dir)
+    agent = PersonalAgent(openrouter_key, semantic_cache_path=semantic_cache_path)
+    comm = TelegramCommunicator(
+        telegram_token,
+        reply_fn=agent.reply,
+        storage_dir=storage_dir,
+        on_startup=agent.warmup,
+        on_shutdown=agent.aclose,
+        clear_cache_fn=agent.clear_cache,
+        stream_fn=agent.stream_reply,
+        admin_user_ids=admin_user_ids,
+    )
 
     log.info("Bot starting...")
-    comm.start()
+    if webhook_url:
+        comm.start_webhook(
+            webhook_url,
+            port=int(os.getenv("WEBHOOK_PORT", "8443")),
+            secret_token=os.getenv("WEBHOOK_SECRET"),
+        )
+    else:
+        comm.start()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
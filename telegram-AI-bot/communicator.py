@@ -3,14 +3,19 @@
 
 from __future__ import annotations
 
-import io
+import asyncio
+import contextlib
 import logging
 import os
-from typing import Awaitable, Protocol, Optional
+import time
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, Iterable, Protocol, Optional
 
 from telegram import Update, InputFile
-from telegram.constants import ChatAction
+from telegram.constants import ChatAction, MessageLimit
+from telegram.error import BadRequest, TelegramError
 from telegram.ext import (
+    AIORateLimiter,
     Application,
     CommandHandler,
     ContextTypes,
@@ -18,15 +23,39 @@ from telegram.ext import (
     filters,
 )
 
-from storage import LocalStorage
+from storage import LocalStorage, StoredFile
 from pdf_service import PdfService
 
 log = logging.getLogger("communicator")
 
+# Minimum seconds between edits of a streamed reply; Telegram asks for about one message per second per chat,
+# and every edit also spends the bot-wide rate limiter budget shared with other chats
+STREAM_EDIT_INTERVAL = 1.0
+# Telegram shows "typing" for ~5s per send_action, so re-sending sooner is a wasted round trip
+TYPING_DEBOUNCE = 4.0
+# Replies faster than this (cache hits, canned answers) go out without a typing indicator
+TYPING_DELAY = 0.5
+FILES_PAGE_SIZE = 50
+# Rendered /files pages are reused for this long unless storage changed in between
+FILES_CACHE_TTL = 2.0
+_TYPING = ChatAction.TYPING
+HYPHEN_PREFIXES = ("/pdf-toruai", "/pdf-bentfly")
+
+def hyphen_theme(text: str) -> Optional[str]:
+    # "/pdf-toruai ..." -> "toruai"; the prefix must end at whitespace or end of text, so "/pdf-toruaiX" doesn't match
+    for prefix in HYPHEN_PREFIXES:
+        if text.startswith(prefix) and (len(text) == len(prefix) or text[len(prefix)].isspace()):
+            return prefix[len("/pdf-"):]
+    return None
+
 class ReplyFn(Protocol):
     def __call__(self, text: str, chat_id: int | str | None, user_id: int | None) -> Awaitable[str]:
         ...
 
+class StreamFn(Protocol):
+    def __call__(self, text: str, chat_id: int | str | None, user_id: int | None) -> AsyncIterator[str]:
+        ...
+
 class Communicator(Protocol):
     def start(self) -> None: ...
     def stop(self) -> None: ...
@@ -34,23 +63,69 @@ class Communicator(Protocol):
 def guess_name(default: str, supplied: Optional[str], fallback_ext: Optional[str] = None) -> str:
     if supplied:
         return supplied
-    if fallback_ext and not default.endswith(f".{fallback_ext.lstrip('.')}"):
-        return f"{default}.{fallback_ext.lstrip('.')}"
-    return default
+    if not fallback_ext:
+        return default
+    ext = fallback_ext if fallback_ext.startswith(".") else "." + fallback_ext
+    return default if default.endswith(ext) else default + ext
 
 class TelegramCommunicator:
     """
     v21+ bot with:
     - AI text replies
     - File storage
-    - Markdown->PDF via md2pdf with CSS themes (/pdf, /pdf_toruai, /pdf_bentfly)
+    - Markdown->PDF via mistune + WeasyPrint with CSS themes (/pdf, /pdf_toruai, /pdf_bentfly)
     Also accepts hyphenated variants typed by users by parsing text manually.
     """
 
-    def __init__(self, token: str, reply_fn: ReplyFn, storage_dir: Optional[str] = "./storage") -> None:
+    def __init__(
+        self,
+        token: str,
+        reply_fn: ReplyFn,
+        storage_dir: Optional[str] = "./storage",
+        on_startup: Optional[Callable[[], Awaitable[None]]] = None,
+        on_shutdown: Optional[Callable[[], Awaitable[None]]] = None,
+        clear_cache_fn: Optional[Callable[[], Awaitable[int]]] = None,
+        stream_fn: Optional[StreamFn] = None,
+        admin_user_ids: Iterable[int] = (),
+    ) -> None:
         self._token = token
+        self._admin_ids = frozenset(admin_user_ids)
         self._reply_fn = reply_fn
-        self._app: Application = Application.builder().token(self._token).build()
+        self._stream_fn = stream_fn
+        self._typing_sent: dict[int, float] = {}
+        self._pdf_warmup: Optional[asyncio.Task] = None
+        self._files_cache: dict[int, tuple[float, int, str]] = {}  # page -> (ts, storage generation, text)
+        self._clear_cache_fn = clear_cache_fn
+        self._on_startup = on_startup
+        self._on_shutdown = on_shutdown
+        # Separate pools so long-polling getUpdates never starves outbound sends; HTTP/2 multiplexes both
+        self._app: Application = (
+            Application.builder()
+            .token(self._token)
+            .connection_pool_size(64)
+            .pool_timeout(10.0)
+            .connect_timeout(5.0)
+            .read_timeout(20.0)
+            .http_version("2")
+            .get_updates_connection_pool_size(4)
+            .get_updates_pool_timeout(30.0)
+            .get_updates_http_version("2")
+            # Handle updates concurrently so one slow download or PDF render doesn't hold up other chats
+            .concurrent_updates(32)
+            # Pace sends under Telegram's limits (~30/s overall, 20/min per group) instead of eating RetryAfter stalls
+            .rate_limiter(
+                AIORateLimiter(
+                    overall_max_rate=28,
+                    overall_time_period=1,
+                    group_max_rate=18,
+                    group_time_period=60,
+                    max_retries=3,
+                )
+            )
+            .post_init(self._post_init)
+            .post_shutdown(self._post_shutdown)
+            .build()
+        )
         self._storage = LocalStorage(storage_dir or "./storage")
         self._pdf = PdfService(self._storage, themes_dir="./css", storage_subdir="md2pdf")
 
@@ -61,6 +136,7 @@ class TelegramCommunicator:
         self._app.add_handler(CommandHandler("get", self._get_cmd))
         self._app.add_handler(CommandHandler("del", self._del_cmd))
         self._app.add_handler(CommandHandler("see", self._see_cmd))
+        self._app.add_handler(CommandHandler("cache_clear", self._cache_clear_cmd))
 
         self._app.add_handler(CommandHandler("pdf", self._pdf_cmd))
         self._app.add_handler(CommandHandler("pdf_toruai", self._pdf_toruai_cmd))
@@ -73,10 +149,8 @@ class TelegramCommunicator:
         self._app.add_handler(MessageHandler(filters.AUDIO, self._on_audio))
         self._app.add_handler(MessageHandler(filters.VOICE, self._on_voice))
 
-        # Text: includes fallback for hyphenated “commands” typed by users
+        # Text; hyphenated “commands” typed by users are caught by prefix in _pdf_cmd/_on_text
         self._app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self._on_text))
-        # Additionally, capture messages that look like commands but with hyphens
-        self._app.add_handler(MessageHandler(filters.TEXT & filters.Regex(r"^/(pdf\-toruai|pdf\-bentfly)\b"), self._on_hyphen_command))
 
         self._app.add_error_handler(self._on_error)
 
@@ -85,7 +159,7 @@ class TelegramCommunicator:
         await update.message.reply_html(
             f"Hi {user.mention_html()}!\n"
             "- Send a file to store it.\n"
-            "- /files to list, /get <id> to retrieve, /del <id> to delete, /see <id>.\n"
+            "- /files [page] to list, /get <id> to retrieve, /del <id> to delete, /see <id>.\n"
             "- Markdown → PDF:\n"
             "    /pdf <markdown>\n"
             "    /pdf_toruai <markdown>\n"
@@ -96,25 +170,51 @@ class TelegramCommunicator:
 
     async def _help_cmd(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.message.reply_text(
-            "Storage: /files, /get <id>, /del <id>, /see <id>\n"
+            "Storage: /files [page], /get <id>, /del <id>, /see <id>\n"
+            "/cache_clear drops cached AI replies (admins only)\n"
             "Markdown → PDF:\n"
             "/pdf TEXT (default CSS)\n/pdf_toruai TEXT\n/pdf_bentfly TEXT\n"
             "Or upload a .md file and I’ll convert.\n"
             "Note: Telegram commands use letters/digits/underscores only per PTB [docs.python-telegram-bot.org](https://docs.python-telegram-bot.org/en/v21.5/telegram.ext.commandhandler.html)."
         )
 
+    async def _cache_clear_cmd(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        user = update.effective_user
+        if not user or user.id not in self._admin_ids:
+            await update.message.reply_text("Not allowed.")
+            return
+        if not self._clear_cache_fn:
+            await update.message.reply_text("No reply cache configured.")
+            return
+        n = await self._clear_cache_fn()
+        await update.message.reply_text(f"Cleared {n} cached replies.")
+
     # ---------- Storage commands ----------
     async def _files_cmd(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        metas = await self._storage.list_files()
-        if not metas:
-            await update.message.reply_text("No files stored.")
+        args = context.args or []
+        page = int(args[0]) if args and args[0].isdigit() and int(args[0]) > 0 else 1
+        now = time.monotonic()
+        gen = self._storage.generation
+        cached = self._files_cache.get(page)
+        if cached and now - cached[0] < FILES_CACHE_TTL and cached[1] == gen:
+            await update.message.reply_text(cached[2])
             return
-        lines = []
-        for m in metas[:100]:
-            lines.append(f"{m.file_id}  {m.orig_name}  {m.size} bytes")
-        if len(metas) > 100:
-            lines.append(f"... and {len(metas)-100} more")
-        await update.message.reply_text("\n".join(lines))
+        text = await self._render_files_page(page)
+        if len(self._files_cache) > 64:
+            self._files_cache.clear()
+        self._files_cache[page] = (now, gen, text)
+        await update.message.reply_text(text)
+
+    async def _render_files_page(self, page: int) -> str:
+        total = await self._storage.count_files()
+        if not total:
+            return "No files stored."
+        pages = (total + FILES_PAGE_SIZE - 1) // FILES_PAGE_SIZE
+        page = min(page, pages)
+        metas = await self._storage.list_files(offset=(page - 1) * FILES_PAGE_SIZE, limit=FILES_PAGE_SIZE)
+        body = "\n".join(f"{m.file_id}  {m.orig_name}  {m.size} bytes" for m in metas)
+        footer = f"\nPage {page}/{pages} ({total} files)" + (f", /files {page + 1} for more" if page < pages else "")
+        return body + footer
 
     async def _get_cmd(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         args = context.args or []
@@ -126,17 +226,12 @@ class TelegramCommunicator:
         if not meta:
             await update.message.reply_text("Not found.")
             return
-        data = await self._storage.read_bytes(fid)
-        if data is None:
-            await update.message.reply_text("File is missing from storage.")
-            return
         try:
-            bio = io.BytesIO(data)
-            bio.name = meta.orig_name or f"{fid}.bin"
-            await update.message.reply_document(
-                document=InputFile(bio, filename=bio.name),
-                caption=f"{meta.orig_name} ({meta.size} bytes)",
+            sent = await self._reply_stored(
+                update, meta, filename=meta.orig_name or f"{fid}.bin", caption=f"{meta.orig_name} ({meta.size} bytes)"
             )
+            if not sent:
+                await update.message.reply_text("File is missing from storage.")
         except Exception as e:
             log.exception("Sending document failed")
             await update.message.reply_text(f"Failed to send: {e}")
@@ -172,7 +267,10 @@ class TelegramCommunicator:
 
     # ---------- PDF commands ----------
     async def _pdf_cmd(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        await self._handle_pdf_text(update, context, theme=None)
+        # Telegram tokenizes "/pdf-toruai" as the /pdf command, so hyphenated variants land here
+        text = update.message.text if update.message else None
+        theme = hyphen_theme(text) if text else None
+        await self._handle_pdf_text(update, context, theme=theme)
 
     async def _pdf_toruai_cmd(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await self._handle_pdf_text(update, context, theme="toruai")
@@ -187,103 +285,191 @@ class TelegramCommunicator:
         if not md_text:
             await update.message.reply_text("Usage: /pdf <markdown text>\nOr upload a .md file.")
             return
-        await update.message.chat.send_action(ChatAction.TYPING)
         try:
-            md_file, pdf_file = await self._pdf.convert_markdown_text(
-                md_text=md_text,
-                theme_name=theme,
-                base_url=os.getcwd(),
-                inferred_name="pasted.md",
-            )
+            async with self._typing(update):
+                md_file, pdf_file = await self._pdf.convert_markdown_text(
+                    md_text=md_text,
+                    theme_name=theme,
+                    base_url=os.getcwd(),
+                    inferred_name="pasted.md",
+                )
         except Exception as e:
-            log.exception("md2pdf conversion failed")
+            log.exception("PDF conversion failed")
             await update.message.reply_text(f"PDF conversion failed: {e}")
             return
-        await update.message.reply_text(f"Saved markdown: {md_file.file_id} ({md_file.orig_name})")
-        await self._send_pdf(update, pdf_file)
+        # Independent sends; issue them together rather than back to back
+        await asyncio.gather(
+            update.message.reply_text(f"Saved markdown: {md_file.file_id} ({md_file.orig_name})"),
+            self._send_pdf(update, pdf_file),
+        )
 
     async def _on_hyphen_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """
-        Handle user-typed hyphenated variants like '/pdf-toruai text' by redirecting to the underscore handler.
+        Handle user-typed hyphenated variants like '/pdf-toruai text' with the matching theme.
         """
         if not update.message or not update.message.text:
             return
-        text = update.message.text
-        if text.startswith("/pdf-toruai"):
-            # Replace only the command part
-            transformed = text.replace("/pdf-toruai", "/pdf_toruai", 1)
-            update.message.text = transformed
-            await self._pdf_toruai_cmd(update, context)
-        elif text.startswith("/pdf-bentfly"):
-            transformed = text.replace("/pdf-bentfly", "/pdf_bentfly", 1)
-            update.message.text = transformed
-            await self._pdf_bentfly_cmd(update, context)
-
-    async def _send_pdf(self, update: Update, pdf_file_meta) -> None:
-        data = await self._storage.read_bytes(pdf_file_meta.file_id)
-        if data is None:
-            await update.message.reply_text("PDF not found in storage.")
-            return
-        bio = io.BytesIO(data)
-        bio.name = pdf_file_meta.orig_name or "document.pdf"
-        await update.message.reply_document(
-            document=InputFile(bio, filename=bio.name),
+        theme = hyphen_theme(update.message.text)
+        if theme:
+            # _handle_pdf_text only looks past the first word, so the message needn't be rewritten
+            await self._handle_pdf_text(update, context, theme=theme)
+
+    async def _send_pdf(self, update: Update, pdf_file_meta: StoredFile) -> None:
+        sent = await self._reply_stored(
+            update,
+            pdf_file_meta,
+            filename=pdf_file_meta.orig_name or "document.pdf",
             caption=f"PDF ready: {pdf_file_meta.orig_name}",
         )
+        if not sent:
+            await update.message.reply_text("PDF not found in storage.")
+
+    async def _reply_stored(self, update: Update, meta: StoredFile, filename: str, caption: str) -> bool:
+        # Read in a thread so the loop never blocks on disk; bytes (unlike a consumed handle) stay valid when the
+        # rate limiter retries the request
+        try:
+            data = await asyncio.to_thread(Path(meta.path).read_bytes)
+        except FileNotFoundError:
+            return False
+        await update.message.reply_document(document=InputFile(data, filename=filename), caption=caption)
+        return True
 
     # ---------- Incoming messages ----------
     async def _on_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        if not update.message or not update.message.text:
+        msg = update.message
+        text = msg.text if msg else None
+        if not text or text.isspace():
             return
         # If it's a hyphenated command without args handler catching it (e.g., bot mentioned), try to normalize
-        if update.message.text.startswith("/pdf-toruai"):
-            await self._on_hyphen_command(update, context)
-            return
-        if update.message.text.startswith("/pdf-bentfly"):
+        if hyphen_theme(text):
             await self._on_hyphen_command(update, context)
             return
 
-        text = update.message.text
-        chat_id = update.effective_chat.id if update.effective_chat else None
-        user_id = update.effective_user.id if update.effective_user else None
+        chat = update.effective_chat
+        user = update.effective_user
+        chat_id = chat.id if chat else None
+        user_id = user.id if user else None
         log.info("Text message from user_id=%s chat_id=%s: %r", user_id, chat_id, text)
+        # Streamed replies show up within a moment, so the typing indicator would only add a round trip
+        if self._stream_fn:
+            await self._stream_reply(update, text, chat_id, user_id)
+            return
         try:
-            await update.message.chat.send_action(ChatAction.TYPING)
-        except Exception:
-            pass
-        try:
-            reply_text = await self._reply_fn(text, chat_id, user_id)
+            async with self._typing(update):
+                reply_text = await self._reply_fn(text, chat_id, user_id)
         except Exception as e:
             log.exception("reply_fn failed")
             reply_text = f"Agent error: {e}"
-        await update.message.reply_text(reply_text)
+        await msg.reply_text(reply_text)
+
+    @contextlib.asynccontextmanager
+    async def _typing(self, update: Update):
+        # Fire the indicator only if the body is still running after TYPING_DELAY, without blocking on it
+        async def later() -> None:
+            await asyncio.sleep(TYPING_DELAY)
+            await self._send_typing(update)
+
+        task = asyncio.create_task(later())
+        try:
+            yield
+        finally:
+            task.cancel()
+
+    async def _send_typing(self, update: Update) -> None:
+        msg = update.message
+        chat_id = msg.chat_id
+        now = time.monotonic()
+        sent = self._typing_sent
+        if now - sent.get(chat_id, 0.0) < TYPING_DEBOUNCE:
+            return
+        sent[chat_id] = now
+        try:
+            await msg.chat.send_action(_TYPING)
+        except Exception:
+            pass
+
+    async def _stream_reply(self, update: Update, text: str, chat_id: int | str | None, user_id: int | None) -> None:
+        # Send the first chunk as a message, then edit it in place at most every STREAM_EDIT_INTERVAL;
+        # text past Telegram's length limit continues in a new message
+        clock = asyncio.get_running_loop().time
+        limit = MessageLimit.MAX_TEXT_LENGTH
+        msg = None
+        buf = ""  # text of the message currently being streamed into
+        shown = ""
+        last_edit = 0.0
+        sent = False
+
+        async def show(final: bool) -> None:
+            nonlocal msg, buf, shown, last_edit, sent
+            while len(buf) > limit:
+                head, buf = buf[:limit], buf[limit:]
+                if msg is None:
+                    await update.message.reply_text(head)
+                    sent = True
+                elif head != shown:
+                    await self._edit_quietly(msg, head)
+                msg, shown = None, ""
+            if not buf or buf.isspace():
+                return
+            if msg is None:
+                msg = await update.message.reply_text(buf)
+                sent = True
+                shown, last_edit = buf, clock()
+            elif buf != shown and (final or clock() - last_edit >= STREAM_EDIT_INTERVAL):
+                await self._edit_quietly(msg, buf)
+                shown, last_edit = buf, clock()
+
+        try:
+            try:
+                # aclosing: if a send fails mid-stream the generator is closed now, releasing the model slot
+                async with contextlib.aclosing(self._stream_fn(text, chat_id, user_id)) as deltas:
+                    async for delta in deltas:
+                        buf += delta
+                        await show(final=False)
+            except TelegramError:
+                raise
+            except Exception as e:
+                log.exception("stream_fn failed")
+                buf = f"{buf}\n\nAgent error: {e}" if buf.strip() else f"Agent error: {e}"
+            await show(final=True)
+            if not sent:
+                await update.message.reply_text("(no content)")
+        except TelegramError:
+            # Telegram refused a send or edit; that's not a model failure, so it isn't reported as one
+            log.exception("Sending streamed reply failed")
+
+    async def _edit_quietly(self, msg, text: str) -> None:
+        try:
+            await msg.edit_text(text)
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
 
     async def _on_document(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         doc = update.message.document if update.message else None
         if not doc:
             return
         tg_file = await doc.get_file()
-        data = await tg_file.download_as_bytearray()
         fname = (doc.file_name or "file.bin")
         lower = fname.lower()
         if lower.endswith(".md") or doc.mime_type in {"text/markdown", "text/x-markdown"}:
             await update.message.reply_text("Markdown detected, converting to PDF...")
+            md_file = await self._store_download(
+                tg_file, orig_name=self._pdf.stored_markdown_name(fname), mime_type="text/markdown"
+            )
             try:
-                md_file, pdf_file = await self._pdf.convert_markdown_file_bytes(
-                    md_data=bytes(data),
-                    orig_filename=fname,
-                    theme_name=None,
-                    base_url=os.getcwd(),
-                )
+                pdf_file = await self._pdf.convert_stored_markdown(md_file, theme_name=None, base_url=os.getcwd())
             except Exception as e:
-                log.exception("md2pdf conversion failed")
+                log.exception("PDF conversion failed")
                 await update.message.reply_text(f"PDF conversion failed: {e}")
                 return
-            await update.message.reply_text(f"Stored markdown: {md_file.file_id} ({md_file.orig_name})")
-            await self._send_pdf(update, pdf_file)
+            await asyncio.gather(
+                update.message.reply_text(f"Stored markdown: {md_file.file_id} ({md_file.orig_name})"),
+                self._send_pdf(update, pdf_file),
+            )
         else:
             orig_name = guess_name(default="file.bin", supplied=fname)
-            meta = await self._storage.save_bytes(bytes(data), orig_name=orig_name, mime_type=doc.mime_type)
+            meta = await self._store_download(tg_file, orig_name=orig_name, mime_type=doc.mime_type)
             await update.message.reply_text(f"Stored file: {meta.file_id} ({meta.orig_name}, {meta.size} bytes)")
 
     async def _on_photo(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -292,10 +478,9 @@ class TelegramCommunicator:
             return
         photo = photos[-1]
         tg_file = await photo.get_file()
-        data = await tg_file.download_as_bytearray()
         unique = getattr(photo, "file_unique_id", None) or "photo"
         orig_name = f"{unique}.jpg"
-        meta = await self._storage.save_bytes(bytes(data), orig_name=orig_name, mime_type="image/jpeg")
+        meta = await self._store_download(tg_file, orig_name=orig_name, mime_type="image/jpeg")
         await update.message.reply_text(f"Stored photo: {meta.file_id} ({meta.orig_name}, {meta.size} bytes)")
 
     async def _on_video(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -303,9 +488,8 @@ class TelegramCommunicator:
         if not vid:
             return
         tg_file = await vid.get_file()
-        data = await tg_file.download_as_bytearray()
         name = guess_name(default="video.mp4", supplied=getattr(vid, "file_name", None))
-        meta = await self._storage.save_bytes(bytes(data), orig_name=name, mime_type=vid.mime_type or "video/mp4")
+        meta = await self._store_download(tg_file, orig_name=name, mime_type=vid.mime_type or "video/mp4")
         await update.message.reply_text(f"Stored video: {meta.file_id} ({meta.orig_name}, {meta.size} bytes)")
 
     async def _on_audio(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -313,9 +497,8 @@ class TelegramCommunicator:
         if not aud:
             return
         tg_file = await aud.get_file()
-        data = await tg_file.download_as_bytearray()
         name = guess_name(default="audio.mp3", supplied=getattr(aud, "file_name", None))
-        meta = await self._storage.save_bytes(bytes(data), orig_name=name, mime_type=aud.mime_type or "audio/mpeg")
+        meta = await self._store_download(tg_file, orig_name=name, mime_type=aud.mime_type or "audio/mpeg")
         await update.message.reply_text(f"Stored audio: {meta.file_id} ({meta.orig_name}, {meta.size} bytes)")
 
     async def _on_voice(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -323,12 +506,35 @@ class TelegramCommunicator:
         if not voice:
             return
         tg_file = await voice.get_file()
-        data = await tg_file.download_as_bytearray()
         unique = getattr(voice, "file_unique_id", None) or "voice"
         orig_name = f"{unique}.ogg"
-        meta = await self._storage.save_bytes(bytes(data), orig_name=orig_name, mime_type=voice.mime_type or "audio/ogg")
+        meta = await self._store_download(tg_file, orig_name=orig_name, mime_type=voice.mime_type or "audio/ogg")
         await update.message.reply_text(f"Stored voice: {meta.file_id} ({meta.orig_name}, {meta.size} bytes)")
 
+    async def _store_download(self, tg_file, orig_name: str, mime_type: Optional[str]):
+        # PTB buffers the whole payload either way (Bot API downloads are capped at 20 MB); save_bytes then
+        # hashes it and writes it to disk in worker threads, keeping both off the event loop
+        data = await tg_file.download_as_bytearray()
+        return await self._storage.save_bytes(data, orig_name=orig_name, mime_type=mime_type)
+
+    async def _post_init(self, app: Application) -> None:
+        # Renderer warm-up takes seconds; let it run alongside the first updates rather than delay startup
+        self._pdf_warmup = asyncio.create_task(self._warm_pdf())
+        if self._on_startup:
+            await self._on_startup()
+
+    async def _warm_pdf(self) -> None:
+        try:
+            await self._pdf.warmup()
+        except Exception:
+            log.warning("PDF renderer warm-up failed", exc_info=True)
+
+    async def _post_shutdown(self, app: Application) -> None:
+        # Runs inside the application's event loop, so async resources close cleanly
+        if self._on_shutdown:
+            await self._on_shutdown()
+        self._pdf.close()
+
     async def _on_error(self, update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
         log.exception("Update caused error: %s", context.error)
 
@@ -336,5 +542,23 @@ class TelegramCommunicator:
         log.info("Starting Telegram polling (run_polling)...")
         self._app.run_polling()
 
+    def start_webhook(
+        self,
+        url: str,
+        listen: str = "0.0.0.0",
+        port: int = 8443,
+        secret_token: Optional[str] = None,
+    ) -> None:
+        # Telegram pushes updates to us; no getUpdates long-poll loop in between
+        log.info("Starting Telegram webhook on %s:%s -> %s", listen, port, url)
+        self._app.run_webhook(
+            listen=listen,
+            port=port,
+            url_path=self._token,
+            webhook_url=f"{url.rstrip('/')}/{self._token}",
+            secret_token=secret_token,
+            max_connections=100,
+        )
+
     def stop(self) -> None:
         pass
\ No newline at end of file
@@ -4,17 +4,60 @@
 from __future__ import annotations
 
 import asyncio
-import io
+import hashlib
+import multiprocessing
 import os
-import tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Optional, Tuple
 
 from storage import LocalStorage, StoredFile
 
-# md2pdf relies on WeasyPrint
-from md2pdf.core import md2pdf
+# Markdown -> HTML with mistune, then WeasyPrint; driving WeasyPrint directly lets parsed stylesheets be reused
+import mistune
+from weasyprint import CSS, HTML
+
+# Tables and footnotes as md2pdf's markdown2 extras had them, plus ~~strikethrough~~
+MARKDOWN_PLUGINS = ["table", "strikethrough", "footnotes"]
+# WeasyPrint layout is mostly pure Python, so renders run in processes rather than GIL-bound threads
+PDF_WORKERS = min(4, os.cpu_count() or 1)
+# Workers are recycled after this many renders to cap WeasyPrint/Pango memory growth
+PDF_TASKS_PER_WORKER = 50
+# Recent render-cache keys kept in memory, in front of the pdf_cache table
+RENDER_CACHE_SIZE = 256
+
+# css path -> (mtime_ns, parsed stylesheet); WeasyPrint's CSS parsing is pure Python and themes rarely change
+_CSS_CACHE: dict[str, tuple[int, CSS]] = {}
+
+def _stylesheet(css_path: Path) -> CSS:
+    key = str(css_path)
+    mtime = css_path.stat().st_mtime_ns
+    cached = _CSS_CACHE.get(key)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    css = CSS(filename=key)
+    _CSS_CACHE[key] = (mtime, css)
+    return css
+
+# Raw HTML in the markdown passes through, as it did with markdown2; the parser keeps no state between calls
+_markdown = mistune.create_markdown(escape=False, plugins=MARKDOWN_PLUGINS)
+
+def _render_pdf(md_data: bytes, css_path: Optional[Path], base_url: str) -> bytes:
+    # Runs in a pool worker, entirely in memory: markdown bytes in, PDF bytes out, no temp files
+    html = _markdown(md_data.decode("utf-8"))
+    stylesheets = [_stylesheet(css_path)] if css_path else None
+    return HTML(string=html, base_url=base_url).write_pdf(stylesheets=stylesheets)
+
+def _warm_worker(css_paths: list[Path]) -> None:
+    # Pool initializer: load Pango/cairo/fontconfig and parse every theme before the first real render
+    try:
+        for css_path in [None, *css_paths]:
+            _render_pdf(b"warm-up", css_path, os.getcwd())
+    except Exception:
+        pass  # a real render will surface the problem
 
 @dataclass
 class CssTheme:
@@ -23,7 +66,7 @@ class CssTheme:
 
 class PdfService:
     """
-    Markdown -> PDF via md2pdf with CSS themes.
+    Markdown -> PDF via mistune + WeasyPrint with CSS themes.
     Saves both the markdown source and resulting PDF via LocalStorage under storage/md2pdf/.
     """
 
@@ -39,10 +82,38 @@ class PdfService:
         self._subdir = storage_subdir
         self._themes: dict[str, CssTheme] = self._load_themes(default_theme_name)
         self._default_theme_name = default_theme_name
+        # css path -> (mtime_ns, content digest); a theme is re-read only after it changes on disk
+        self._css_digests: dict[Path, tuple[int, str]] = {}
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # key -> (md file_id, pdf file_id); ids rather than rows so a /del is seen through get_meta
+        self._recent: OrderedDict[str, tuple[str, str]] = OrderedDict()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn, not fork: the parent is running an event loop with open sockets
+            self._pool = ProcessPoolExecutor(
+                max_workers=PDF_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                max_tasks_per_child=PDF_TASKS_PER_WORKER,
+                initializer=_warm_worker,
+                initargs=([t.css_path for t in self._themes.values() if t.css_path],),
+            )
+        return self._pool
+
+    async def warmup(self) -> None:
+        # Workers start on demand; submitting one trivial task per slot spawns them (and runs their warm-up) now
+        loop = asyncio.get_running_loop()
+        pool = self._executor()
+        await asyncio.gather(*(loop.run_in_executor(pool, os.getpid) for _ in range(PDF_WORKERS)))
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
 
     def _load_themes(self, default_theme_name: str) -> dict[str, CssTheme]:
         mapping = {
-            "default": None,                 # use md2pdf/weasyprint defaults
+            "default": None,                 # use WeasyPrint defaults
             "toruai": self._themes_dir / "toruai.css",
             "bentfly": self._themes_dir / "bentfly.css",
         }
@@ -73,33 +144,87 @@ class PdfService:
         Returns (stored_markdown, stored_pdf)
         """
         md_bytes = md_text.encode("utf-8")
+        key = self._cache_key(md_bytes, theme_name, base_url)
+        cached = await self._cached(key)
+        if cached:
+            return cached
         md_file = await self._storage.save_bytes(
             data=md_bytes,
             orig_name=f"{self._subdir}-{inferred_name}",
             mime_type="text/markdown",
         )
         pdf_file = await self._render_pdf_from_bytes(md_bytes, md_file.orig_name, theme_name, base_url)
+        await self._put_cached(key, md_file, pdf_file)
         return md_file, pdf_file
 
-    async def convert_markdown_file_bytes(
+    def stored_markdown_name(self, orig_filename: str) -> str:
+        safe_name = orig_filename if orig_filename.lower().endswith(".md") else f"{orig_filename}.md"
+        return f"{self._subdir}-{safe_name}"
+
+    async def convert_stored_markdown(
         self,
-        md_data: bytes,
-        orig_filename: str,
+        md_file: StoredFile,
         theme_name: Optional[str],
         base_url: Optional[str] = None,
-    ) -> Tuple[StoredFile, StoredFile]:
+    ) -> StoredFile:
         """
-        Convert uploaded Markdown bytes to PDF.
-        Returns (stored_markdown, stored_pdf)
+        Convert Markdown already saved in storage (e.g. downloaded straight to disk).
+        Returns stored_pdf
         """
-        safe_name = orig_filename if orig_filename.lower().endswith(".md") else f"{orig_filename}.md"
-        md_file = await self._storage.save_bytes(
-            data=md_data,
-            orig_name=f"{self._subdir}-{safe_name}",
-            mime_type="text/markdown",
-        )
+        md_data = await asyncio.to_thread(Path(md_file.path).read_bytes)
+        # Uploads can be megabytes; hash off the event loop
+        key = await asyncio.to_thread(self._cache_key, md_data, theme_name, base_url)
+        cached = await self._cached(key)
+        if cached:
+            return cached[1]
         pdf_file = await self._render_pdf_from_bytes(md_data, md_file.orig_name, theme_name, base_url)
-        return md_file, pdf_file
+        await self._put_cached(key, md_file, pdf_file)
+        return pdf_file
+
+    async def _cached(self, key: str) -> Optional[Tuple[StoredFile, StoredFile]]:
+        ids = self._recent.get(key)
+        if ids is not None:
+            # Both rows are usually in storage's metadata cache, so a repeat costs no query
+            md_file, pdf_file = await self._storage.get_meta(ids[0]), await self._storage.get_meta(ids[1])
+            if md_file and pdf_file:
+                self._recent.move_to_end(key)
+                return md_file, pdf_file
+            del self._recent[key]
+        cached = await self._storage.get_pdf_cache(key)
+        if cached:
+            self._remember(key, cached[0].file_id, cached[1].file_id)
+        return cached
+
+    async def _put_cached(self, key: str, md_file: StoredFile, pdf_file: StoredFile) -> None:
+        self._remember(key, md_file.file_id, pdf_file.file_id)
+        await self._storage.put_pdf_cache(key, md_file.file_id, pdf_file.file_id)
+
+    def _remember(self, key: str, md_id: str, pdf_id: str) -> None:
+        self._recent[key] = (md_id, pdf_id)
+        self._recent.move_to_end(key)
+        if len(self._recent) > RENDER_CACHE_SIZE:
+            self._recent.popitem(last=False)
+
+    def _cache_key(self, md_data: bytes, theme_name: Optional[str], base_url: Optional[str]) -> str:
+        # Same markdown + theme stylesheet contents + base_url renders the same PDF
+        theme = self._pick_theme(theme_name)
+        h = hashlib.blake2b(md_data, digest_size=16)
+        h.update(f"\0{theme.name}\0{self._css_digest(theme.css_path)}\0{base_url or ''}".encode())
+        return h.hexdigest()
+
+    def _css_digest(self, css_path: Optional[Path]) -> str:
+        if css_path is None:
+            return ""
+        try:
+            mtime = css_path.stat().st_mtime_ns
+        except OSError:
+            return ""
+        cached = self._css_digests.get(css_path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        digest = hashlib.blake2b(css_path.read_bytes(), digest_size=16).hexdigest()
+        self._css_digests[css_path] = (mtime, digest)
+        return digest
 
     async def _render_pdf_from_bytes(
         self,
@@ -109,11 +234,20 @@ class PdfService:
         base_url: Optional[str],
     ) -> StoredFile:
         """
-        Render using md2pdf by writing a temp .md and producing a temp .pdf, then saving bytes to storage.
-        This avoids relying on md2pdf's function signature variations.
+        Render in a worker process straight to PDF bytes, then save them to storage.
         """
         theme = self._pick_theme(theme_name)
-        pdf_bytes = await asyncio.to_thread(self._md2pdf_via_disk, md_data, theme, base_url)
+        pool = self._executor()
+        try:
+            pdf_bytes = await asyncio.get_running_loop().run_in_executor(
+                pool, _render_pdf, md_data, theme.css_path, base_url or os.getcwd()
+            )
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM on a huge document); start a fresh pool next time
+            if self._pool is pool:
+                self._pool = None
+            pool.shutdown(wait=False)
+            raise
         pdf_name = os.path.splitext(markdown_name)[0] + ".pdf"
         stored_pdf = await self._storage.save_bytes(
             data=pdf_bytes,
@@ -121,66 +255,3 @@ class PdfService:
             mime_type="application/pdf",
         )
         return stored_pdf
-
-    def _md2pdf_via_disk(self, md_data: bytes, theme: CssTheme, base_url: Optional[str]) -> bytes:
-        # Prepare temp files
-        with tempfile.TemporaryDirectory() as td:
-            tdir = Path(td)
-            md_path = tdir / "input.md"
-            pdf_path = tdir / "output.pdf"
-            md_path.write_bytes(md_data)
-
-            # Try calling md2pdf with different supported signatures:
-            # Newer versions: md2pdf(input_file=..., output_file=..., stylesheets=[...], base_url=...)
-            # Some versions:  md2pdf(input_file=..., output_path=..., css_file_path=[...], base_url=...)
-            css_list = [str(theme.css_path)] if theme.css_path else None
-            used = False
-
-            # Attempt 1: input_file/output_file
-            try:
-                md2pdf(
-                    input_file=str(md_path),
-                    output_file=str(pdf_path),
-                    stylesheets=css_list,
-                    base_url=base_url or str(md_path.parent),
-                )
-                used = True
-            except TypeError:
-                pass
-
-            # Attempt 2: input_file/output_path/css_file_path
-            if not used:
-                try:
-                    md2pdf(
-                        input_file=str(md_path),
-                        output_path=str(pdf_path),
-                        css_file_path=css_list,
-                        base_url=base_url or str(md_path.parent),
-                    )
-                    used = True
-                except TypeError:
-                    pass
-
-            # Attempt 3: positional (input, output)
-            if not used:
-                try:
-                    if css_list:
-                        md2pdf(str(md_path), str(pdf_path), stylesheets=css_list, base_url=base_url or str(md_path.parent))
-                    else:
-                        md2pdf(str(md_path), str(pdf_path), base_url=base_url or str(md_path.parent))
-                    used = True
-                except TypeError:
-                    pass
-
-            if not used:
-                # Last resort: md_content -> output_path
-                try:
-                    if css_list:
-                        md2pdf(output_path=str(pdf_path), md_content=[md_data.decode("utf-8")], stylesheets=css_list, base_url=base_url or str(md_path.parent))
-                    else:
-                        md2pdf(output_path=str(pdf_path), md_content=[md_data.decode("utf-8")], base_url=base_url or str(md_path.parent))
-                    used = True
-                except TypeError as e:
-                    raise TypeError(f"Incompatible md2pdf version/API: {e}")
-
-            return pdf_path.read_bytes()
\ No newline at end of file
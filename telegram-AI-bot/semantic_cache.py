@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import sqlite3
+from typing import Optional
+
+import numpy as np
+from openai import AsyncOpenAI
+
+log = logging.getLogger(__name__)
+
+# Rows scored per matmul block; 8192 x 1536 int8 is ~12 MB, ~48 MB once widened for the product
+LOOKUP_BLOCK = 8192
+# Appended rows are folded into the on-disk matrix once this many are pending
+FLUSH_EVERY = 256
+
+def quantize(vec: np.ndarray) -> tuple[np.ndarray, float]:
+    # Symmetric per-row int8: row ~= q * scale
+    peak = float(np.max(np.abs(vec))) if vec.size else 0.0
+    scale = peak / 127.0 if peak else 1.0
+    return np.round(vec / scale).astype(np.int8), scale
+
+def _scan(parts: list[tuple[int, np.ndarray, np.ndarray]], vec: np.ndarray) -> tuple[int, float]:
+    best_idx, best_sim = -1, -1.0
+    for first, rows, scales in parts:
+        if rows.shape[1] != vec.shape[0]:
+            return -1, -1.0
+        for start in range(0, len(rows), LOOKUP_BLOCK):
+            # int8 rows are widened per block: the scan reads a quarter of the bytes, the product stays in BLAS
+            sims = (rows[start:start + LOOKUP_BLOCK].astype(np.float32) @ vec) * scales[start:start + LOOKUP_BLOCK]
+            i = int(np.argmax(sims))
+            if sims[i] > best_sim:
+                best_idx, best_sim = first + start + i, float(sims[i])
+    return best_idx, best_sim
+
+class EmbeddingCache:
+    """
+    Nearest-neighbour reply cache: embeds prompts and returns a prior answer
+    when cosine similarity to a cached prompt clears the threshold.
+    Persisted as <path>.npy (L2-normalized rows quantized to int8, memory-mapped on load),
+    <path>.scales.npy (float32 per-row scale) and <path>.db (SQLite, row index -> reply).
+    """
+
+    def __init__(
+        self,
+        client: AsyncOpenAI,
+        path: Optional[str] = None,
+        model: str = "openai/text-embedding-3-small",
+        threshold: float = 0.92,
+        max_entries: int = 200000,
+    ) -> None:
+        self._client = client
+        self._path = path
+        self._model = model
+        self._threshold = threshold
+        self._max_entries = max_entries
+        self._lock = asyncio.Lock()
+        # Rows already on disk (mmap'd int8 + scales) plus rows appended since the last flush
+        self._base: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._pending: list[tuple[np.ndarray, float]] = []
+        self._pending_mat: Optional[tuple[np.ndarray, np.ndarray]] = None
+        # Bumped whenever row indices shift (trim, clear) so an off-thread lookup can tell its result is stale
+        self._epoch = 0
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(f"{path}.db" if path else ":memory:", check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS replies(idx INTEGER PRIMARY KEY, reply TEXT NOT NULL)")
+        self._db.commit()
+        if path:
+            self._load()
+
+    def _count(self) -> int:
+        return (len(self._base) if self._base is not None else 0) + len(self._pending)
+
+    def _load(self) -> None:
+        npy = f"{self._path}.npy"
+        if not os.path.exists(npy):
+            return
+        try:
+            base = np.load(npy, mmap_mode="r")
+            scales = np.load(f"{self._path}.scales.npy")
+        except Exception:
+            log.exception("Failed to load semantic cache from %s", self._path)
+            return
+        (n,) = self._db.execute("SELECT COUNT(*) FROM replies").fetchone()
+        if base.ndim != 2 or base.dtype != np.int8 or len(scales) != len(base) or n < len(base):
+            log.warning("Semantic cache %s is inconsistent, ignoring", self._path)
+            self._db.execute("DELETE FROM replies")
+            self._db.commit()
+            return
+        if n > len(base):
+            # Replies are committed per add but vectors only per flush; after an unclean exit the unflushed
+            # tail has rows without vectors. Drop just those and keep everything that was flushed.
+            log.warning("Semantic cache %s lost %d unflushed entries", self._path, n - len(base))
+            self._db.execute("DELETE FROM replies WHERE idx >= ?", (len(base),))
+            self._db.commit()
+        self._base, self._scales = base, scales
+
+    def _merged(self, pending: list[tuple[np.ndarray, float]], keep: int) -> tuple[list[np.ndarray], np.ndarray, int]:
+        parts = ([self._base] if self._base is not None else []) + ([np.vstack([q for q, _ in pending])] if pending else [])
+        scales = np.concatenate(
+            ([self._scales] if self._scales is not None else [])
+            + ([np.asarray([sc for _, sc in pending], dtype=np.float32)] if pending else [])
+        )
+        return parts, scales[len(scales) - keep:], len(scales) - keep
+
+    def _flush_to_disk(self, parts: list[np.ndarray], scales: np.ndarray, skip: int) -> tuple[np.ndarray, np.ndarray]:
+        # Runs off the event loop; writes a fresh matrix and atomically swaps it in
+        keep, dim = len(scales), parts[0].shape[1]
+        npy, tmp = f"{self._path}.npy", f"{self._path}.npy.tmp"
+        out = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.int8, shape=(keep, dim))
+        pos = 0
+        for p in parts:
+            if skip >= len(p):
+                skip -= len(p)
+                continue
+            rows = p[skip:]
+            skip = 0
+            out[pos:pos + len(rows)] = rows
+            pos += len(rows)
+        out.flush()
+        del out
+        with open(f"{self._path}.scales.npy.tmp", "wb") as f:
+            np.save(f, scales)
+        os.replace(f"{self._path}.scales.npy.tmp", f"{self._path}.scales.npy")
+        os.replace(tmp, npy)
+        return np.load(npy, mmap_mode="r"), scales
+
+    async def _flush(self) -> None:
+        if not self._pending:
+            return
+        pending = self._pending
+        total = self._count()
+        keep = min(total, self._max_entries)
+        parts, scales, cut = self._merged(pending, keep)
+        if self._path:
+            base, scales = await asyncio.to_thread(self._flush_to_disk, parts, scales, cut)
+        else:
+            base = np.vstack(parts)[cut:]
+        # Swap state and renumber replies on the loop thread so lookups never see a half-applied trim
+        if cut:
+            self._epoch += 1
+            self._db.execute("DELETE FROM replies WHERE idx < ?", (cut,))
+            self._db.execute("UPDATE replies SET idx = idx - ?", (cut,))
+            self._db.commit()
+        self._base, self._scales = base, scales
+        self._pending = self._pending[len(pending):]
+        self._pending_mat = None
+
+    async def save(self) -> None:
+        async with self._lock:
+            await self._flush()
+
+    def close(self) -> None:
+        self._db.close()
+
+    async def clear(self) -> int:
+        # Under the lock so a flush in progress can't reinstall the old matrix after the clear
+        async with self._lock:
+            return self._clear()
+
+    def _clear(self) -> int:
+        n = self._count()
+        self._epoch += 1
+        self._base = self._scales = None
+        self._pending = []
+        self._pending_mat = None
+        self._db.execute("DELETE FROM replies")
+        self._db.commit()
+        if self._path:
+            for suffix in (".npy", ".scales.npy"):
+                try:
+                    os.remove(f"{self._path}{suffix}")
+                except FileNotFoundError:
+                    pass
+        return n
+
+    async def embed(self, text: str) -> np.ndarray:
+        resp = await self._client.embeddings.create(model=self._model, input=[text])
+        vec = np.asarray(resp.data[0].embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def _parts(self) -> list[tuple[int, np.ndarray, np.ndarray]]:
+        # (first row index, int8 rows, scales) for the on-disk matrix and the pending rows
+        parts = []
+        base = self._base
+        if base is not None:
+            parts.append((0, base, self._scales))
+        if self._pending:
+            if self._pending_mat is None or len(self._pending_mat[0]) != len(self._pending):
+                self._pending_mat = (
+                    np.vstack([q for q, _ in self._pending]),
+                    np.asarray([sc for _, sc in self._pending], dtype=np.float32),
+                )
+            parts.append((len(base) if base is not None else 0, *self._pending_mat))
+        return parts
+
+    async def lookup(self, vec: np.ndarray) -> Optional[str]:
+        parts = self._parts()
+        epoch = self._epoch
+        if sum(len(rows) for _, rows, _ in parts) <= LOOKUP_BLOCK:
+            best_idx, best_sim = _scan(parts, vec)
+        else:
+            # A full cache is hundreds of MB of int8 to widen and page in; keep that off the event loop
+            best_idx, best_sim = await asyncio.to_thread(_scan, parts, vec)
+        if best_idx < 0 or best_sim < self._threshold or epoch != self._epoch:
+            # (a trim or clear while scanning renumbered the rows, so best_idx may point at another reply)
+            return None
+        row = self._db.execute("SELECT reply FROM replies WHERE idx = ?", (best_idx,)).fetchone()
+        return row[0] if row else None
+
+    async def add(self, vec: np.ndarray, reply: str) -> None:
+        async with self._lock:
+            base = self._base
+            dim = base.shape[1] if base is not None else (self._pending[0][0].shape[0] if self._pending else vec.shape[0])
+            if dim != vec.shape[0]:
+                # Embedding model changed; old rows can't be compared
+                self._clear()
+            idx = self._count()
+            self._pending.append(quantize(vec))
+            self._db.execute("INSERT OR REPLACE INTO replies(idx, reply) VALUES (?, ?)", (idx, reply))
+            self._db.commit()
+            # Trimming to max_entries rides on the batched flush; checking the cap per add would rewrite the
+            # whole matrix on every reply once the cache is full
+            if len(self._pending) >= FLUSH_EVERY:
+                await self._flush()
@@ -6,12 +6,23 @@ from __future__ import annotations
 import asyncio
 import hashlib
 import json
+import logging
 import os
+import secrets
+import sqlite3
+import tempfile
+import threading
 import time
-from dataclasses import dataclass, asdict
+from collections import OrderedDict
+from dataclasses import dataclass, fields
 from pathlib import Path
 from typing import Optional
 
+log = logging.getLogger(__name__)
+
+# Recently saved or looked-up rows kept in memory so /get and friends skip the thread hop + query
+META_CACHE_SIZE = 4096
+
 @dataclass
 class StoredFile:
     file_id: str
@@ -20,82 +31,261 @@ class StoredFile:
     size: int
     path: str
     created_ts: float
+    content_hash: Optional[str] = None  # blake2b-128 hex; rows with the same hash share one blob
+
+_FIELDS = tuple(f.name for f in fields(StoredFile))
+_COLUMNS = ", ".join(_FIELDS)
+_INSERT_META = f"INSERT OR REPLACE INTO meta({_COLUMNS}) VALUES ({', '.join('?' * len(_FIELDS))})"
+
+def _row(meta: StoredFile) -> tuple:
+    # StoredFile is flat, so a plain attribute tuple does what astuple() does without its recursive copy
+    return tuple(getattr(meta, name) for name in _FIELDS)
+
+def _hash_file(path: Path) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
 
 class LocalStorage:
     """
-    Simple local filesystem storage.
+    Simple local filesystem storage, content-addressed: identical uploads share one blob.
     base/
-      files/<file_id>
-      meta/<file_id>.json
+      files/<hash[:2]>/<hash>
+      meta.db  (SQLite, WAL; one row per stored file, several rows may point at one blob)
+      tmp/  (in-flight downloads, same filesystem so save_path can rename)
+    Legacy meta/<file_id>.json sidecars are imported into meta.db on startup.
     """
 
     def __init__(self, base_dir: str | Path = "./storage") -> None:
         self.base = Path(base_dir)
         self.files_dir = self.base / "files"
         self.meta_dir = self.base / "meta"
+        self.tmp_dir = self.base / "tmp"
         self._lock = asyncio.Lock()
+        # Bumped on every add/delete so callers can cheaply tell whether a cached listing is stale
+        self.generation = 0
+        self._meta_cache: OrderedDict[str, StoredFile] = OrderedDict()
         self.files_dir.mkdir(parents=True, exist_ok=True)
-        self.meta_dir.mkdir(parents=True, exist_ok=True)
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        # Anything left in tmp/ was in flight when a previous run died; nothing refers to it any more
+        for stale in self.tmp_dir.iterdir():
+            stale.unlink(missing_ok=True)
+        # One connection shared by worker threads; _db_lock serializes access to it
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(self.base / "meta.db", check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS meta("
+            "file_id TEXT PRIMARY KEY, orig_name TEXT, mime_type TEXT, size INTEGER, path TEXT, created_ts REAL, "
+            "content_hash TEXT)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS meta_created ON meta(created_ts DESC)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS meta_hash ON meta(content_hash)")
+        # Render cache: key -> previously stored (markdown, pdf) pair
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pdf_cache(key TEXT PRIMARY KEY, md_file_id TEXT, pdf_file_id TEXT, created_ts REAL)"
+        )
+        self._db.commit()
+        self._import_json_sidecars()
+
+    def _import_json_sidecars(self) -> None:
+        if not self.meta_dir.is_dir():
+            return
+        metas, done = [], []
+        with os.scandir(self.meta_dir) as it:
+            for de in it:
+                if not de.name.endswith(".json"):
+                    continue
+                try:
+                    with open(de.path, "r", encoding="utf-8") as f:
+                        metas.append(_row(StoredFile(**json.load(f))))
+                except (OSError, ValueError, TypeError):
+                    # Unreadable, malformed JSON or wrong fields; left in place for a look
+                    log.warning("Skipping unreadable meta sidecar %s", de.path)
+                    continue
+                done.append(de.path)
+        # One transaction for the lot rather than a commit per sidecar
+        with self._db:
+            self._db.executemany(_INSERT_META, metas)
+        for path in done:
+            os.unlink(path)
+        try:
+            self.meta_dir.rmdir()
+        except OSError:
+            pass
+
+    def _query(self, sql: str, params: tuple = ()) -> list[tuple]:
+        with self._db_lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def _exec(self, sql: str, params: tuple = ()) -> int:
+        with self._db_lock:
+            cur = self._db.execute(sql, params)
+            self._db.commit()
+            return cur.rowcount
 
-    async def save_bytes(self, data: bytes, orig_name: str, mime_type: Optional[str]) -> StoredFile:
+    async def save_bytes(self, data: bytes | bytearray | memoryview, orig_name: str, mime_type: Optional[str]) -> StoredFile:
+        # Any buffer is hashed and written as-is; callers needn't copy a bytearray into bytes first
+        digest = await asyncio.to_thread(lambda: hashlib.blake2b(data, digest_size=16).hexdigest())
         async with self._lock:
-            created = time.time()
-            h = hashlib.sha256()
-            h.update(data)
-            h.update(str(created).encode())
-            fid = h.hexdigest()[:16]
-            fpath = self.files_dir / fid
-
-            await asyncio.to_thread(self._write_bytes, fpath, data)
-            meta = StoredFile(
-                file_id=fid,
-                orig_name=orig_name,
-                mime_type=mime_type,
-                size=len(data),
-                path=str(fpath),
-                created_ts=created,
-            )
-            await asyncio.to_thread(self._write_meta, fid, meta)
-            return meta
+            meta = await asyncio.to_thread(self._link_existing, digest, orig_name, mime_type, memoryview(data).nbytes)
+            if meta is not None:
+                return self._added(meta)
+        # New content is written outside the lock so a large blob doesn't hold up other saves;
+        # save_path re-checks under the lock in case an identical upload landed meanwhile
+        tmp = self.tmp_path()
+        try:
+            await asyncio.to_thread(self._write_bytes, tmp, data)
+            return await self.save_path(tmp, orig_name=orig_name, mime_type=mime_type, content_hash=digest)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
 
-    def _write_bytes(self, path: Path, data: bytes) -> None:
-        with open(path, "wb") as f:
-            f.write(data)
+    def _blob_path(self, digest: str) -> Path:
+        return self.files_dir / digest[:2] / digest
 
-    def _write_meta(self, fid: str, meta: StoredFile) -> None:
-        mpath = self.meta_dir / f"{fid}.json"
-        with open(mpath, "w", encoding="utf-8") as f:
-            json.dump(asdict(meta), f, ensure_ascii=False, indent=2)
+    def _blob_for(self, digest: str) -> Optional[Path]:
+        # Existing blob with this content, if any row still points at one on disk
+        rows = self._query("SELECT path FROM meta WHERE content_hash = ? LIMIT 1", (digest,))
+        if rows and os.path.exists(rows[0][0]):
+            return Path(rows[0][0])
+        return None
 
-    async def list_files(self) -> list[StoredFile]:
-        metas: list[StoredFile] = []
-        for mfile in sorted(self.meta_dir.glob("*.json")):
-            try:
-                meta = await asyncio.to_thread(self._read_meta_file, mfile)
-                metas.append(meta)
-            except Exception:
-                continue
-        return metas
+    def _insert_row(self, orig_name: str, mime_type: Optional[str], size: int, fpath: Path, digest: str) -> StoredFile:
+        meta = StoredFile(
+            file_id=self._new_id(),
+            orig_name=orig_name,
+            mime_type=mime_type,
+            size=size,
+            path=str(fpath),
+            created_ts=time.time(),
+            content_hash=digest,
+        )
+        self._write_meta(meta)
+        return meta
+
+    def _link_existing(self, digest: str, orig_name: str, mime_type: Optional[str], size: int) -> Optional[StoredFile]:
+        # Dedup check and row insert in one worker-thread hop; None if the content isn't stored yet
+        fpath = self._blob_for(digest)
+        return self._insert_row(orig_name, mime_type, size, fpath, digest) if fpath else None
+
+    def _adopt(self, tmp_path: Path, digest: str, orig_name: str, mime_type: Optional[str]) -> StoredFile:
+        # stat, dedup check, rename (or drop) and row insert in one worker-thread hop
+        size = os.stat(tmp_path).st_size
+        fpath = self._blob_for(digest)
+        if fpath is None:
+            fpath = self._blob_path(digest)
+            fpath.parent.mkdir(exist_ok=True)
+            os.replace(tmp_path, fpath)
+        else:
+            tmp_path.unlink(missing_ok=True)
+        return self._insert_row(orig_name, mime_type, size, fpath, digest)
+
+    def _added(self, meta: StoredFile) -> StoredFile:
+        self._cache_meta(meta)
+        self.generation += 1
+        return meta
 
-    def _read_meta_file(self, path: Path) -> StoredFile:
-        with open(path, "r", encoding="utf-8") as f:
-            obj = json.load(f)
-        return StoredFile(**obj)
+    def _cache_meta(self, meta: StoredFile) -> None:
+        self._meta_cache[meta.file_id] = meta
+        self._meta_cache.move_to_end(meta.file_id)
+        if len(self._meta_cache) > META_CACHE_SIZE:
+            self._meta_cache.popitem(last=False)
+
+    def _new_id(self) -> str:
+        # Random 16-hex id per upload; identical content still gets its own id and row
+        while True:
+            fid = secrets.token_hex(8)
+            if not self._query("SELECT 1 FROM meta WHERE file_id = ?", (fid,)):
+                return fid
+
+    def tmp_path(self) -> Path:
+        fd, name = tempfile.mkstemp(dir=self.tmp_dir)
+        os.close(fd)
+        return Path(name)
+
+    async def save_path(
+        self,
+        tmp_path: str | Path,
+        orig_name: str,
+        mime_type: Optional[str],
+        content_hash: Optional[str] = None,
+    ) -> StoredFile:
+        """Adopt a file already written under tmp/ by renaming it into files/ (no copy); dropped if a duplicate."""
+        tmp_path = Path(tmp_path)
+        digest = content_hash or await asyncio.to_thread(_hash_file, tmp_path)
+        async with self._lock:
+            return self._added(await asyncio.to_thread(self._adopt, tmp_path, digest, orig_name, mime_type))
+
+    def _write_bytes(self, path: Path, data: bytes | bytearray | memoryview) -> None:
+        # Raw fd writes, no BufferedWriter layer; loops because write(2) may be short for huge buffers
+        path.parent.mkdir(exist_ok=True)
+        view = memoryview(data).cast("B")
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+
+    def _write_meta(self, meta: StoredFile) -> None:
+        self._exec(_INSERT_META, _row(meta))
+
+    async def count_files(self) -> int:
+        rows = await asyncio.to_thread(self._query, "SELECT COUNT(*) FROM meta")
+        return rows[0][0]
+
+    async def list_files(self, offset: int = 0, limit: int = 50) -> list[StoredFile]:
+        """Newest first."""
+        rows = await asyncio.to_thread(
+            self._query,
+            f"SELECT {_COLUMNS} FROM meta ORDER BY created_ts DESC LIMIT ? OFFSET ?",
+            (limit, offset),
+        )
+        return [StoredFile(*r) for r in rows]
 
     async def get_meta(self, file_id: str) -> Optional[StoredFile]:
-        mpath = self.meta_dir / f"{file_id}.json"
-        if not mpath.exists():
+        meta = self._meta_cache.get(file_id)
+        if meta is not None:
+            self._meta_cache.move_to_end(file_id)
+            return meta
+        gen = self.generation
+        rows = await asyncio.to_thread(self._query, f"SELECT {_COLUMNS} FROM meta WHERE file_id = ?", (file_id,))
+        if not rows:
             return None
-        return await asyncio.to_thread(self._read_meta_file, mpath)
+        meta = StoredFile(*rows[0])
+        # A delete may have run while the query was off-thread; don't resurrect the row in the cache
+        if gen == self.generation:
+            self._cache_meta(meta)
+        return meta
 
-    async def read_bytes(self, file_id: str) -> Optional[bytes]:
-        meta = await self.get_meta(file_id)
-        if not meta:
+    async def get_pdf_cache(self, key: str) -> Optional[tuple[StoredFile, StoredFile]]:
+        """Cached (markdown, pdf) for key, if both files still exist."""
+        md_cols = ", ".join(f"md.{c}" for c in _COLUMNS.split(", "))
+        pdf_cols = ", ".join(f"pdf.{c}" for c in _COLUMNS.split(", "))
+        rows = await asyncio.to_thread(
+            self._query,
+            f"SELECT {md_cols}, {pdf_cols} FROM pdf_cache c "
+            "JOIN meta md ON md.file_id = c.md_file_id JOIN meta pdf ON pdf.file_id = c.pdf_file_id "
+            "WHERE c.key = ?",
+            (key,),
+        )
+        if not rows:
             return None
-        fpath = Path(meta.path)
-        if not fpath.exists():
+        n = len(_FIELDS)
+        md, pdf = StoredFile(*rows[0][:n]), StoredFile(*rows[0][n:])
+        if not await asyncio.to_thread(Path(pdf.path).exists):
             return None
-        return await asyncio.to_thread(fpath.read_bytes)
+        return md, pdf
+
+    async def put_pdf_cache(self, key: str, md_file_id: str, pdf_file_id: str) -> None:
+        await asyncio.to_thread(
+            self._exec,
+            "INSERT OR REPLACE INTO pdf_cache(key, md_file_id, pdf_file_id, created_ts) VALUES (?, ?, ?, ?)",
+            (key, md_file_id, pdf_file_id, time.time()),
+        )
 
     async def delete(self, file_id: str) -> bool:
         async with self._lock:
@@ -103,12 +293,22 @@ class LocalStorage:
             if not meta:
                 return False
             ok = True
+            self.generation += 1
+            self._meta_cache.pop(file_id, None)
             try:
-                Path(meta.path).unlink(missing_ok=True)
-            except Exception:
-                ok = False
-            try:
-                (self.meta_dir / f"{file_id}.json").unlink(missing_ok=True)
+                await asyncio.to_thread(self._exec, "DELETE FROM meta WHERE file_id = ?", (file_id,))
+                await asyncio.to_thread(
+                    self._exec, "DELETE FROM pdf_cache WHERE md_file_id = ? OR pdf_file_id = ?", (file_id, file_id)
+                )
             except Exception:
                 ok = False
+            # The blob goes only with its last reference
+            shared = meta.content_hash and await asyncio.to_thread(
+                self._query, "SELECT 1 FROM meta WHERE content_hash = ? LIMIT 1", (meta.content_hash,)
+            )
+            if not shared:
+                try:
+                    Path(meta.path).unlink(missing_ok=True)
+                except Exception:
+                    ok = False
             return ok
\ No newline at end of file